@@ -1,26 +1,99 @@
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from psycopg2 import pool
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from io import BytesIO
 import hashlib
-import pandas as pd
-from datetime import datetime, timedelta
+import hmac
+import secrets
+import threading
+import time
+import bcrypt
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+import atexit
+import itertools
+import logging
 import os
-import pytz
-from weakref import WeakSet
+import re
 
-from assistant import suggest_best_driver, calculate_distance
+def fetch_dicts(cursor):
+    """Lignes d'un curseur tuple converties en dicts, noms de colonnes lus une seule fois."""
+    columns = [column.name for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
-_pool_connections = WeakSet()
+class PooledConnection(psycopg2.extensions.connection):
+    """Connexion qui sait si elle a été empruntée au pool."""
 
-def get_scalar_result(cursor):
-    result = cursor.fetchone()
-    if result is None:
-        return None
-    return list(result. values())[0]
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.from_pool = False
+
+class PreparingConnection(PooledConnection):
+    """Connexion qui mémorise les requêtes déjà préparées côté serveur (PREPARE)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()
+
+_PLACEHOLDER_RE = re.compile(r'%%|%s')
+
+def _to_dollar_params(sql):
+    """Convertit les paramètres %s de psycopg2 en $1, $2... pour PREPARE."""
+    counter = itertools.count(1)
+    return _PLACEHOLDER_RE.sub(lambda m: '%' if m.group() == '%%' else f'${next(counter)}', sql)
+
+# Requêtes préparées gardées par connexion, les moins récemment utilisées sont libérées
+MAX_PREPARED_PER_CONNECTION = 100
+
+@lru_cache(maxsize=256)
+def _statement_name(sql):
+    """Nom de requête préparée dérivé du texte SQL : une requête par forme de SQL."""
+    return 's_' + hashlib.blake2b(sql.encode(), digest_size=8).hexdigest()
+
+def execute_prepared(cursor, sql, params=()):
+    """PREPARE la requête une seule fois par connexion, puis EXECUTE par son nom."""
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if prepared is None:
+        cursor.execute(sql, params)
+        return
+    name = _statement_name(sql)
+    if name in prepared:
+        prepared.move_to_end(name)
+    else:
+        cursor.execute(f"PREPARE {name} AS {_to_dollar_params(sql)}")
+        prepared[name] = True
+        if len(prepared) > MAX_PREPARED_PER_CONNECTION:
+            oldest, _ = prepared.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {oldest}")
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+# Sans effet si un handler racine existe déjà ; WARNING par défaut en production
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+TIMEZONE = ZoneInfo('Europe/Paris')
+
+def now_paris():
+    return datetime.now(TIMEZONE)
 
-TIMEZONE = pytz.timezone('Europe/Paris')
+def today_paris():
+    return now_paris().date()
+
+def paris_day_bounds(jour):
+    """Début et fin (exclue) d'une journée à Paris, en datetimes avec fuseau."""
+    debut = datetime.combine(jour, datetime.min.time(), tzinfo=TIMEZONE)
+    fin = datetime.combine(jour + timedelta(days=1), datetime.min.time(), tzinfo=TIMEZONE)
+    return debut, fin
 
 st.set_page_config(
     page_title="Transport DanGE - Planning",
@@ -28,96 +101,259 @@ st.set_page_config(
     layout="wide"
 )
 
-@st.cache_resource
+def _connection_kwargs():
+    supabase = st.secrets.get("supabase", {}) or {}
+    if "connection_string" in supabase and supabase["connection_string"]:
+        kwargs = {'dsn': supabase["connection_string"], 'cursor_factory': RealDictCursor}
+    else:
+        kwargs = {
+            'host': supabase.get("host"),
+            'database': supabase.get("database"),
+            'user': supabase.get("user"),
+            'password': supabase.get("password"),
+            'port': supabase.get("port"),
+            'sslmode': 'require',
+            'cursor_factory': RealDictCursor
+        }
+    # Keepalives TCP : le pooler Supabase coupe les connexions inactives
+    kwargs.update(
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=5,
+        application_name='taxi-planning',
+    )
+    # Pooler Supabase en mode transaction (port 6543) : pgBouncer change de session
+    # à chaque transaction et refuse le paramètre de connexion options
+    transaction_pooler = '6543' in str(supabase.get("port", "")) or ':6543' in str(supabase.get("connection_string", ""))
+    # Une requête bloquée ne doit pas immobiliser une connexion du pool
+    statement_timeout = int(supabase.get("statement_timeout_ms", 0 if transaction_pooler else 15000))
+    if statement_timeout:
+        kwargs['options'] = f'-c statement_timeout={statement_timeout}'
+    # PREPARE est lié à la session serveur : désactivé par défaut derrière ce pooler
+    if supabase.get("prepared_statements", not transaction_pooler):
+        kwargs['connection_factory'] = PreparingConnection
+    else:
+        kwargs['connection_factory'] = PooledConnection
+    return kwargs
+
+class KeepAlivePool(pool.ThreadedConnectionPool):
+    """ThreadedConnectionPool qui garde au repos jusqu'à maxconn connexions.
+
+    psycopg2 ferme toute connexion rendue au-delà de minconn : chaque pic de
+    charge repayait TCP + TLS + authentification et perdait les requêtes
+    préparées. Les connexions inutilisées depuis idle_timeout secondes sont
+    fermées au prochain emprunt, sans descendre sous minconn.
+    """
+
+    def __init__(self, minconn, maxconn, *args, idle_timeout=300, **kwargs):
+        self.idle_timeout = idle_timeout
+        self._idle_since = {}
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _getconn(self, key=None):
+        self._close_idle()
+        conn = super()._getconn(key)
+        self._idle_since.pop(id(conn), None)
+        return conn
+
+    def _putconn(self, conn, key=None, close=False):
+        if self.closed:
+            raise pool.PoolError("connection pool is closed")
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise pool.PoolError("trying to put unkeyed connection")
+        status = None if conn.closed else conn.info.transaction_status
+        if close or status in (None, psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN):
+            conn.close()
+        else:
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._idle_since[id(conn)] = time.monotonic()
+            self._pool.append(conn)
+        del self._used[key]
+        del self._rused[id(conn)]
+
+    def _close_idle(self):
+        # getconn reprend la fin de la liste : les plus anciennes sont en tête
+        limit = time.monotonic() - self.idle_timeout
+        while len(self._pool) > self.minconn and self._idle_since.get(id(self._pool[0]), 0) < limit:
+            conn = self._pool.pop(0)
+            self._idle_since.pop(id(conn), None)
+            conn.close()
+
+@st.cache_resource(show_spinner=False)
 def get_connection_pool():
+    """Pool unique par processus, partagé par toutes les sessions Streamlit."""
     try:
-        supabase = st.secrets. get("supabase", {}) or {}
-        if "connection_string" in supabase and supabase["connection_string"]: 
-            return pool.SimpleConnectionPool(1, 10, supabase["connection_string"])
-        else:
-            return pool.SimpleConnectionPool(
-                1, 10,
-                host=supabase.get("host"),
-                database=supabase.get("database"),
-                user=supabase.get("user"),
-                password=supabase.get("password"),
-                port=supabase. get("port"),
-                sslmode='require'
-            )
+        supabase = st.secrets.get("supabase", {}) or {}
+        conn_pool = KeepAlivePool(
+            int(supabase.get("pool_min", os.getenv("PG_POOL_MIN", 1))),
+            int(supabase.get("pool_max", os.getenv("PG_POOL_MAX", 10))),
+            idle_timeout=int(supabase.get("pool_idle_timeout", 300)),
+            **_connection_kwargs()
+        )
+        atexit.register(conn_pool.closeall)
+        return conn_pool
     except Exception as e:
         st.error(f"Erreur pool connexion:  {e}")
         return None
 
+# Le script est réexécuté à chaque rerun : ce raccourci ne vit que le temps
+# d'une exécution, le pool lui-même reste unique via st.cache_resource.
+_POOL = None
+
+def _get_pool():
+    global _POOL
+    if _POOL is None:
+        _POOL = get_connection_pool()
+    return _POOL
+
 def release_db_connection(conn):
-    global _pool_connections
+    if not conn:
+        return
     try:
-        if not conn: 
+        if conn.from_pool:
+            # Socket coupé (timeout pooler, redémarrage) : fermer plutôt que recycler
+            _get_pool().putconn(conn, close=bool(conn.closed))
             return
-        conn_pool = get_connection_pool()
-        if conn in _pool_connections and conn_pool:
-            try:
-                conn_pool.putconn(conn)
-                _pool_connections.discard(conn)
-            except Exception: 
-                try:
-                    conn. close()
-                    _pool_connections.discard(conn)
-                except Exception:
-                    pass
-        else:
-            try:
-                conn. close()
-            except Exception:
-                pass
-    except Exception as e:
-        print(f"Erreur release_db_connection: {e}")
+    except Exception:
+        logger.exception("Erreur release_db_connection")
+    try:
+        conn.close()
+    except Exception:
+        pass
 
 def get_db_connection():
-    global _pool_connections
     try:
-        conn_pool = get_connection_pool()
-        if conn_pool: 
+        conn_pool = _get_pool()
+        if conn_pool:
             conn = conn_pool.getconn()
-            conn. cursor_factory = RealDictCursor
-            _pool_connections.add(conn)
+            conn.from_pool = True
             return conn
-        supabase = st.secrets.get("supabase", {}) or {}
-        if "connection_string" in supabase and supabase["connection_string"]: 
-            conn = psycopg2.connect(supabase["connection_string"], cursor_factory=RealDictCursor)
-        else:
-            conn = psycopg2.connect(
-                host=supabase.get("host"),
-                database=supabase.get("database"),
-                user=supabase.get("user"),
-                password=supabase.get("password"),
-                port=supabase.get("port"),
-                sslmode='require',
-                cursor_factory=RealDictCursor
-            )
-        return conn
-    except Exception as e: 
+        # Repli hors pool : connexion fermée à la restitution
+        return psycopg2.connect(**_connection_kwargs())
+    except Exception as e:
         st.error(f"Erreur de connexion à la base de données: {e}")
         return None
 
+@contextmanager
+def get_conn():
+    """Emprunte une connexion et la rend toujours au pool, même en cas d'erreur."""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+@contextmanager
+def db_cursor(dict_rows=True, name=None):
+    """Curseur sur une connexion du pool : commit en sortie normale, rollback
+    sur exception, connexion toujours rendue. Fournit None si la base est
+    injoignable. Avec name, curseur côté serveur : les lignes arrivent par
+    paquets de cursor.itersize au lieu d'être toutes chargées en mémoire."""
+    with get_conn() as conn:
+        if conn is None:
+            yield None
+            return
+        factory = RealDictCursor if dict_rows else psycopg2.extensions.cursor
+        cursor = conn.cursor(name=name, cursor_factory=factory)
+        # Curseur fermé avant commit/rollback : un curseur nommé n'est plus
+        # valide une fois la transaction terminée
+        try:
+            yield cursor
+            cursor.close()
+            conn.commit()
+        except psycopg2.IntegrityError:
+            # Contrainte violée (doublon...) : gérée par l'appelant
+            cursor.close()
+            conn.rollback()
+            raise
+        except Exception:
+            logger.exception("Erreur SQL, transaction annulée")
+            cursor.close()
+            conn.rollback()
+            raise
+
+@st.cache_resource(show_spinner=False)
 def init_db():
-    init_notifications_table()
+    """Schéma vérifié une seule fois par processus, pas à chaque rerun."""
+    return init_notifications_table()
+
+# Coût bcrypt (2^n tours) : chaque login coûte un calcul complet à ce coût
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "10"))
+
+def _bcrypt_secret(password):
+    # bcrypt ne lit que 72 octets ; bcrypt >= 5 lève ValueError au-delà
+    return password.encode()[:72]
 
 def hash_password(password):
-    return hashlib.sha256(password. encode()).hexdigest()
+    return bcrypt.hashpw(_bcrypt_secret(password), bcrypt.gensalt(rounds=BCRYPT_COST)).decode()
+
+def is_legacy_hash(password_hash):
+    return not password_hash.startswith('$2')
+
+def needs_rehash(password_hash):
+    """Hash SHA-256 historique ou bcrypt d'un coût différent de BCRYPT_COST."""
+    if is_legacy_hash(password_hash):
+        return True
+    # Format $2b$12$... : le coût est entre le 2e et le 3e '$'
+    return password_hash.split('$')[2] != f"{BCRYPT_COST:02d}"
+
+VERIFIED_CACHE_SIZE = 1024
+
+@st.cache_resource(show_spinner=False)
+def _verified_passwords():
+    """Vérifications bcrypt réussies, partagées par les sessions du processus.
+    Clé : HMAC (secret aléatoire du processus) du hash et du mot de passe ;
+    aucun mot de passe n'est conservé en clair."""
+    return secrets.token_bytes(32), OrderedDict(), threading.Lock()
+
+def _verified_key(pepper, password, password_hash):
+    message = password_hash.encode() + b':' + hashlib.sha256(password.encode()).digest()
+    return hmac.new(pepper, message, 'sha256').digest()
+
+def verify_password(password, password_hash):
+    if not password_hash:
+        return False
+    if is_legacy_hash(password_hash):
+        # Ancien format SHA-256 hexadécimal, remplacé par bcrypt au prochain login réussi
+        legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy_hash, password_hash)
+    # Reconnexion (rechargement mobile, session perdue) : évite de refaire le bcrypt.
+    # Le hash fait partie de la clé, un changement de mot de passe invalide l'entrée.
+    pepper, verified, lock = _verified_passwords()
+    key = _verified_key(pepper, password, password_hash)
+    with lock:
+        if key in verified:
+            verified.move_to_end(key)
+            return True
+    if not bcrypt.checkpw(_bcrypt_secret(password), password_hash.encode()):
+        return False
+    with lock:
+        verified[key] = True
+        if len(verified) > VERIFIED_CACHE_SIZE:
+            verified.popitem(last=False)
+    return True
 
 def login(username, password):
-    conn = get_db_connection()
-    if not conn:
-        return None
-    cursor = conn.cursor()
-    hashed_password = hash_password(password)
-    cursor.execute('''
-        SELECT id, username, role, full_name
-        FROM users
-        WHERE username = %s AND password_hash = %s
-    ''', (username, hashed_password))
-    user = cursor.fetchone()
-    release_db_connection(conn)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return None
+        execute_prepared(cursor, '''
+            SELECT id, username, role, full_name, password_hash
+            FROM users
+            WHERE username = %s
+        ''', (username,))
+        user = cursor.fetchone()
+        if user and not verify_password(password, user['password_hash']):
+            user = None
+        if user and needs_rehash(user['password_hash']):
+            cursor.execute(
+                'UPDATE users SET password_hash = %s WHERE id = %s',
+                (hash_password(password), user['id'])
+            )
     if user:
         return {
             'id': user['id'],
@@ -127,287 +363,297 @@ def login(username, password):
         }
     return None
 
+@st.cache_data(ttl=60, show_spinner=False)
 def get_chauffeurs():
-    conn = get_db_connection()
-    if not conn:
-        return []
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, full_name, username
-        FROM users
-        WHERE role = 'chauffeur'
-        ORDER BY full_name
-    ''')
-    chauffeurs = cursor.fetchall()
-    release_db_connection(conn)
-    return [{'id': c['id'], 'full_name': c['full_name'], 'username': c['username']} for c in chauffeurs]
+    with db_cursor() as cursor:
+        if cursor is None:
+            return []
+        cursor.execute('''
+            SELECT id, full_name, username
+            FROM users
+            WHERE role = 'chauffeur'
+            ORDER BY full_name
+        ''')
+        chauffeurs = cursor.fetchall()
+    return [dict(c) for c in chauffeurs]
+
+def _chauffeur_index(chauffeurs):
+    """Nom affiché -> id, pour résoudre le choix d'un selectbox sans reparcourir la liste."""
+    return {c['full_name']: c['id'] for c in chauffeurs}
 
 def init_notifications_table():
-    conn = get_db_connection()
-    if not conn:
-        return
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
-            id SERIAL PRIMARY KEY,
-            chauffeur_id INTEGER REFERENCES users(id),
-            course_id INTEGER,
-            message TEXT,
-            type VARCHAR(50),
-            lu BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    release_db_connection(conn)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return False
+        # Table et index envoyés en un seul aller-retour.
+        # UNLOGGED : notifications éphémères, pas de WAL (vidée si le serveur plante).
+        # Badge et liste des non lues : l'index partiel suit exactement le filtre et le tri
+        cursor.execute('''
+            CREATE UNLOGGED TABLE IF NOT EXISTS notifications (
+                id SERIAL PRIMARY KEY,
+                chauffeur_id INTEGER REFERENCES users(id),
+                course_id INTEGER,
+                message TEXT,
+                type VARCHAR(50),
+                lu BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_notif_chauffeur_unread
+            ON notifications (chauffeur_id, created_at DESC)
+            WHERE lu = FALSE;
+            DELETE FROM notifications
+            WHERE created_at < NOW() - INTERVAL '7 days';
+        ''')
+    return True
 
 def create_notification(chauffeur_id, course_id, message, notification_type='nouvelle_course'):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO notifications (chauffeur_id, course_id, message, type)
-        VALUES (%s, %s, %s, %s)
-    ''', (chauffeur_id, course_id, message, notification_type))
-    conn.commit()
-    release_db_connection(conn)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return False
+        execute_prepared(cursor, '''
+            INSERT INTO notifications (chauffeur_id, course_id, message, type)
+            VALUES (%s, %s, %s, %s)
+        ''', (chauffeur_id, course_id, message, notification_type))
     return True
 
-def get_unread_notifications(chauffeur_id):
-    conn = get_db_connection()
-    if not conn:
-        return []
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT n.id, n.message, n.type, n.created_at, n.course_id,
-               c.nom_client, c.adresse_pec, c.lieu_depose, c.heure_pec_prevue
-        FROM notifications n
-        LEFT JOIN courses c ON n.course_id = c.id
-        WHERE n.chauffeur_id = %s AND n.lu = FALSE
-        ORDER BY n.created_at DESC
-        LIMIT 20
-    ''', (chauffeur_id,))
-    notifs = cursor.fetchall()
-    release_db_connection(conn)
-    return [dict(n) for n in notifs]
+def get_unread_notifications(chauffeur_id, cursor=None):
+    """Renvoie (20 dernières notifications non lues, nombre total de non lues)."""
+    with db_cursor(dict_rows=False) if cursor is None else nullcontext(cursor) as cursor:
+        if cursor is None:
+            return [], 0
+        execute_prepared(cursor, '''
+            SELECT n.id, n.message, n.type, n.created_at, n.course_id,
+                   c.nom_client, c.adresse_pec, c.lieu_depose, c.heure_pec_prevue,
+                   COUNT(*) OVER () AS total_unread
+            FROM notifications n
+            LEFT JOIN courses c ON n.course_id = c.id
+            WHERE n.chauffeur_id = %s AND n.lu = FALSE
+            ORDER BY n.created_at DESC
+            LIMIT 20
+        ''', (chauffeur_id,))
+        notifs = fetch_dicts(cursor)
+    total_unread = notifs[0]['total_unread'] if notifs else 0
+    return notifs, total_unread
+
+# Purge des notifications de plus de 7 jours : au démarrage (init_db) puis au plus une fois par heure
+NOTIFICATIONS_PURGE_INTERVAL = 3600
+
+@st.cache_resource(show_spinner=False)
+def _notifications_purge_state():
+    # Date de la dernière purge, partagée par toutes les sessions du processus
+    return {'last': time.monotonic()}, threading.Lock()
+
+def purge_old_notifications(cursor):
+    state, lock = _notifications_purge_state()
+    now = time.monotonic()
+    with lock:
+        if now - state['last'] < NOTIFICATIONS_PURGE_INTERVAL:
+            return
+        state['last'] = now
+    execute_prepared(cursor, '''
+        DELETE FROM notifications
+        WHERE created_at < NOW() - INTERVAL '7 days'
+    ''')
 
 def mark_notifications_as_read(chauffeur_id):
-    conn = get_db_connection()
-    if not conn:
-        return
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE notifications
-        SET lu = TRUE
-        WHERE chauffeur_id = %s AND lu = FALSE
-    ''', (chauffeur_id,))
-    conn.commit()
-    release_db_connection(conn)
-
-def get_unread_count(chauffeur_id):
-    conn = get_db_connection()
-    if not conn:
-        return 0
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COUNT(*) FROM notifications
-        WHERE chauffeur_id = %s AND lu = FALSE
-    ''', (chauffeur_id,))
-    result = cursor.fetchone()
-    release_db_connection(conn)
-    return list(result. values())[0] if result else 0
-
-def create_client_regulier(data):
-    conn = get_db_connection()
-    if not conn:
-        return None
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO clients_reguliers (
-            nom_complet, telephone, adresse_pec_habituelle, adresse_depose_habituelle,
-            type_course_habituel, tarif_habituel, km_habituels, remarques
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    ''', (
-        data['nom_complet'],
-        data. get('telephone'),
-        data.get('adresse_pec_habituelle'),
-        data.get('adresse_depose_habituelle'),
-        data.get('type_course_habituel'),
-        data.get('tarif_habituel'),
-        data.get('km_habituels'),
-        data.get('remarques')
-    ))
-    client_id = cursor.lastrowid
-    conn.commit()
-    release_db_connection(conn)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return
+        execute_prepared(cursor, '''
+            UPDATE notifications
+            SET lu = TRUE
+            WHERE chauffeur_id = %s AND lu = FALSE
+        ''', (chauffeur_id,))
+        purge_old_notifications(cursor)
+
+def create_client_regulier(data, cursor=None):
+    """cursor : curseur tuple déjà ouvert pour écrire dans la transaction de l'appelant,
+    qui doit alors vider get_clients_reguliers après son commit."""
+    own_transaction = cursor is None
+    with db_cursor(dict_rows=False) if own_transaction else nullcontext(cursor) as cursor:
+        if cursor is None:
+            return None
+        cursor.execute('''
+            INSERT INTO clients_reguliers (
+                nom_complet, telephone, adresse_pec_habituelle, adresse_depose_habituelle,
+                type_course_habituel, tarif_habituel, km_habituels, remarques
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        ''', (
+            data['nom_complet'],
+            data. get('telephone'),
+            data.get('adresse_pec_habituelle'),
+            data.get('adresse_depose_habituelle'),
+            data.get('type_course_habituel'),
+            data.get('tarif_habituel'),
+            data.get('km_habituels'),
+            data.get('remarques')
+        ))
+        # lastrowid est un OID avec psycopg2, pas l'id de la ligne
+        result = cursor.fetchone()
+        client_id = result[0] if result else None
+    # Après le commit : vidé plus tôt, une autre session remettrait en cache l'ancienne liste
+    if own_transaction:
+        get_clients_reguliers.clear()
     return client_id
 
+# Une entrée par terme de recherche saisi : nombre d'entrées borné
+@st.cache_data(ttl=30, max_entries=100, show_spinner=False)
 def get_clients_reguliers(search_term=None):
-    conn = get_db_connection()
-    if not conn:
-        return []
-    cursor = conn.cursor()
-    if search_term:
-        cursor.execute('''
-            SELECT * FROM clients_reguliers
-            WHERE actif = 1 AND nom_complet LIKE %s
-            ORDER BY nom_complet
-        ''', (f'%{search_term}%',))
-    else:
-        cursor.execute('''
-            SELECT * FROM clients_reguliers
-            WHERE actif = 1
-            ORDER BY nom_complet
-        ''')
-    clients = cursor.fetchall()
-    release_db_connection(conn)
-    result = []
-    for client in clients:
-        result.append({
-            'id': client['id'],
-            'nom_complet':  client['nom_complet'],
-            'telephone': client['telephone'],
-            'adresse_pec_habituelle': client['adresse_pec_habituelle'],
-            'adresse_depose_habituelle': client['adresse_depose_habituelle'],
-            'type_course_habituel':  client['type_course_habituel'],
-            'tarif_habituel': client['tarif_habituel'],
-            'km_habituels': client['km_habituels'],
-            'remarques': client['remarques']
-        })
-    return result
+    with db_cursor(dict_rows=False) as cursor:
+        if cursor is None:
+            return []
+        if search_term:
+            cursor.execute('''
+                SELECT id, nom_complet, telephone, adresse_pec_habituelle,
+                       adresse_depose_habituelle, type_course_habituel,
+                       tarif_habituel, km_habituels, remarques
+                FROM clients_reguliers
+                WHERE actif = 1 AND nom_complet ILIKE %s
+                ORDER BY nom_complet
+            ''', (f'%{search_term}%',))
+        else:
+            cursor.execute('''
+                SELECT id, nom_complet, telephone, adresse_pec_habituelle,
+                       adresse_depose_habituelle, type_course_habituel,
+                       tarif_habituel, km_habituels, remarques
+                FROM clients_reguliers
+                WHERE actif = 1
+                ORDER BY nom_complet
+            ''')
+        clients = fetch_dicts(cursor)
+    return clients
 
 def get_client_regulier(client_id):
-    conn = get_db_connection()
-    if not conn:
-        return None
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM clients_reguliers WHERE id = %s', (client_id,))
-    client = cursor.fetchone()
-    release_db_connection(conn)
-    if client:
-        return {
-            'id': client['id'],
-            'nom_complet':  client['nom_complet'],
-            'telephone': client['telephone'],
-            'adresse_pec_habituelle': client['adresse_pec_habituelle'],
-            'adresse_depose_habituelle': client['adresse_depose_habituelle'],
-            'type_course_habituel':  client['type_course_habituel'],
-            'tarif_habituel': client['tarif_habituel'],
-            'km_habituels': client['km_habituels'],
-            'remarques': client['remarques']
-        }
-    return None
+    with db_cursor(dict_rows=False) as cursor:
+        if cursor is None:
+            return None
+        cursor.execute('''
+            SELECT id, nom_complet, telephone, adresse_pec_habituelle,
+                   adresse_depose_habituelle, type_course_habituel,
+                   tarif_habituel, km_habituels, remarques
+            FROM clients_reguliers
+            WHERE id = %s
+        ''', (client_id,))
+        clients = fetch_dicts(cursor)
+    return clients[0] if clients else None
 
 def update_client_regulier(client_id, data):
-    conn = get_db_connection()
-    if not conn:
-        return
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE clients_reguliers
-        SET nom_complet = %s, telephone = %s, adresse_pec_habituelle = %s,
-            adresse_depose_habituelle = %s, type_course_habituel = %s,
-            tarif_habituel = %s, km_habituels = %s, remarques = %s
-        WHERE id = %s
-    ''', (
-        data['nom_complet'],
-        data.get('telephone'),
-        data.get('adresse_pec_habituelle'),
-        data.get('adresse_depose_habituelle'),
-        data.get('type_course_habituel'),
-        data.get('tarif_habituel'),
-        data.get('km_habituels'),
-        data.get('remarques'),
-        client_id
-    ))
-    conn.commit()
-    release_db_connection(conn)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return
+        cursor.execute('''
+            UPDATE clients_reguliers
+            SET nom_complet = %s, telephone = %s, adresse_pec_habituelle = %s,
+                adresse_depose_habituelle = %s, type_course_habituel = %s,
+                tarif_habituel = %s, km_habituels = %s, remarques = %s
+            WHERE id = %s
+        ''', (
+            data['nom_complet'],
+            data.get('telephone'),
+            data.get('adresse_pec_habituelle'),
+            data.get('adresse_depose_habituelle'),
+            data.get('type_course_habituel'),
+            data.get('tarif_habituel'),
+            data.get('km_habituels'),
+            data.get('remarques'),
+            client_id
+        ))
+    get_clients_reguliers.clear()
 
 def delete_client_regulier(client_id):
-    conn = get_db_connection()
-    if not conn:
-        return
-    cursor = conn.cursor()
-    cursor.execute('UPDATE clients_reguliers SET actif = 0 WHERE id = %s', (client_id,))
-    conn.commit()
-    release_db_connection(conn)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return
+        cursor.execute('UPDATE clients_reguliers SET actif = 0 WHERE id = %s', (client_id,))
+    get_clients_reguliers.clear()
 
-def create_course(data):
-    conn = get_db_connection()
-    if not conn:
-        return None
-    cursor = conn. cursor()
+def create_course(data, cursor=None):
+    """cursor : curseur tuple déjà ouvert pour écrire dans la transaction de l'appelant."""
     heure_prevue = data['heure_prevue']
     if isinstance(heure_prevue, str):
         heure_prevue = datetime.fromisoformat(heure_prevue. replace('Z', '+00:00'))
     if heure_prevue. tzinfo is None:
-        heure_prevue = TIMEZONE.localize(heure_prevue)
+        heure_prevue = heure_prevue.replace(tzinfo=TIMEZONE)
     else:
         heure_prevue = heure_prevue.astimezone(TIMEZONE)
-    date_course = heure_prevue.date()
-    date_aujourdhui = datetime.now(TIMEZONE).date()
-    visible_chauffeur = (date_course <= date_aujourdhui)
-    cursor.execute('''
-        INSERT INTO courses (
-            chauffeur_id, nom_client, telephone_client, adresse_pec,
-            lieu_depose, heure_prevue, heure_pec_prevue, temps_trajet_minutes,
-            heure_depart_calculee, type_course, tarif_estime,
-            km_estime, commentaire, created_by, client_regulier_id, visible_chauffeur
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-    ''', (
-        data['chauffeur_id'],
-        data['nom_client'],
-        data['telephone_client'],
-        data['adresse_pec'],
-        data['lieu_depose'],
-        data['heure_prevue'],
-        data. get('heure_pec_prevue'),
-        data.get('temps_trajet_minutes'),
-        data.get('heure_depart_calculee'),
-        data['type_course'],
-        data['tarif_estime'],
-        data['km_estime'],
-        data['commentaire'],
-        data['created_by'],
-        data. get('client_regulier_id'),
-        visible_chauffeur
-    ))
-    result = cursor.fetchone()
-    course_id = result['id'] if result else None
-    conn.commit()
-    release_db_connection(conn)
-    return course_id
+    with db_cursor(dict_rows=False) if cursor is None else nullcontext(cursor) as cursor:
+        if cursor is None:
+            return None
+        execute_prepared(cursor, '''
+            INSERT INTO courses (
+                chauffeur_id, nom_client, telephone_client, adresse_pec,
+                lieu_depose, heure_prevue, heure_pec_prevue, temps_trajet_minutes,
+                heure_depart_calculee, type_course, tarif_estime,
+                km_estime, commentaire, created_by, client_regulier_id, visible_chauffeur
+            ) VALUES (
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                -- Visible d'emblée si la course est pour aujourd'hui (ou passée), heure de Paris
+                (%s::timestamptz AT TIME ZONE 'Europe/Paris')::date
+                    <= (now() AT TIME ZONE 'Europe/Paris')::date
+            )
+            RETURNING id
+        ''', (
+            data['chauffeur_id'],
+            data['nom_client'],
+            data['telephone_client'],
+            data['adresse_pec'],
+            data['lieu_depose'],
+            heure_prevue,
+            data. get('heure_pec_prevue'),
+            data.get('temps_trajet_minutes'),
+            data.get('heure_depart_calculee'),
+            data['type_course'],
+            data['tarif_estime'],
+            data['km_estime'],
+            data['commentaire'],
+            data['created_by'],
+            data. get('client_regulier_id'),
+            heure_prevue
+        ))
+        result = cursor.fetchone()
+    return result[0] if result else None
+
+@lru_cache(maxsize=1024)
+def _iso_date_fr(iso_str):
+    """'AAAA-MM-JJ...' → 'JJ/MM/AAAA' par découpage, sans passer par datetime."""
+    if len(iso_str) < 10:
+        return iso_str
+    if iso_str[4] == '-' and iso_str[7] == '-':
+        return f"{iso_str[8:10]}/{iso_str[5:7]}/{iso_str[0:4]}"
+    annee, mois, jour = iso_str[0:10].split('-')
+    return f"{jour}/{mois}/{annee}"
+
+@lru_cache(maxsize=1024)
+def _iso_datetime_fr(iso_str):
+    if len(iso_str) >= 16:
+        return f"{_iso_date_fr(iso_str)} {iso_str[11:16]}"
+    return _iso_date_fr(iso_str)
+
+def to_paris(value):
+    """Ramène un datetime avec fuseau à l'heure de Paris (la session PostgreSQL
+    renvoie les timestamptz en UTC) ; un datetime naïf est déjà une heure de Paris."""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(TIMEZONE)
+    return value
 
 def format_date_fr(date_input):
     if not date_input:
         return ""
-    if isinstance(date_input, datetime):
-        date_str = date_input.strftime('%Y-%m-%d')
-    else:
-        date_str = str(date_input)
-    if len(date_str) < 10:
-        return date_str
-    annee, mois, jour = date_str[0:10].split('-')
-    return f"{jour}/{mois}/{annee}"
+    date_input = to_paris(date_input)
+    # date couvre aussi datetime (sous-classe)
+    if isinstance(date_input, date):
+        return f"{date_input.day:02d}/{date_input.month:02d}/{date_input.year:04d}"
+    return _iso_date_fr(str(date_input))
 
 def format_datetime_fr(datetime_input):
     if not datetime_input: 
         return ""
     try:
         if isinstance(datetime_input, datetime):
-            datetime_str = datetime_input.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            datetime_str = str(datetime_input)
-        datetime_str = datetime_str.replace('T', ' ')
-        if len(datetime_str) >= 16:
-            date_part = datetime_str[0:10]
-            time_part = datetime_str[11:16]
-            annee, mois, jour = date_part.split('-')
-            return f"{jour}/{mois}/{annee} {time_part}"
-        else:
-            return format_date_fr(datetime_input)
+            d = to_paris(datetime_input)
+            return f"{d.day:02d}/{d.month:02d}/{d.year:04d} {d.hour:02d}:{d.minute:02d}"
+        return _iso_datetime_fr(str(datetime_input))
     except:
         return str(datetime_input)
 
@@ -415,25 +661,45 @@ def extract_time_str(datetime_input):
     if not datetime_input:
         return ""
     if isinstance(datetime_input, datetime):
-        return datetime_input.strftime('%H:%M')
+        d = to_paris(datetime_input)
+        return f"{d.hour:02d}:{d.minute:02d}"
     datetime_str = str(datetime_input)
     if len(datetime_str) >= 16:
         return datetime_str[11:16]
     return ""
 
-def get_courses(chauffeur_id=None, date_filter=None, role=None, days_back=30, limit=100, show_all=False):
+# Heure saisie « H:MM » ou « HH:MM »
+_HHMM_RE = re.compile(r'([01]?\d|2[0-3]):([0-5]\d)')
+
+def normalize_hhmm(value):
+    """'9:05' -> '09:05' ; None si la saisie n'est pas une heure valide."""
+    match = _HHMM_RE.fullmatch(value.strip()) if value else None
+    return f"{int(match.group(1)):02d}:{match.group(2)}" if match else None
+
+# Libellé du filtre de statut -> valeur en base
+STATUTS_COURSE = {'Nouvelle': 'nouvelle', 'Confirmée': 'confirmee', 'PEC': 'pec', 'Déposée': 'deposee'}
+# Pastille et libellé affichés dans les titres des listes de courses
+STATUT_EMOJIS = {'nouvelle': '🔵', 'confirmee': '🟡', 'pec': '🔴', 'deposee': '🟢'}
+STATUT_LIBELLES = {'nouvelle': 'NOUVELLE', 'confirmee': 'CONFIRMÉE', 'pec': 'PRISE EN CHARGE', 'deposee': 'TERMINÉE'}
+
+def get_courses(chauffeur_id=None, date_filter=None, role=None, days_back=30, limit=100, show_all=False, statut=None, cursor=None):
     """
     Récupère les courses
     Si show_all=True, récupère TOUTES les courses sans filtre de date
+    statut : valeur en base ('nouvelle', 'confirmee'...), filtrée par PostgreSQL
+    cursor : curseur tuple déjà ouvert à réutiliser (même connexion, même transaction) ;
+             les erreurs remontent alors à l'appelant, qui annule sa transaction
     """
-    conn = get_db_connection()
-    if not conn:
-        return []
-
-    cursor = conn.cursor()
-
+    shared_cursor = cursor is not None
     query = '''
-        SELECT c.*, u.full_name as chauffeur_name
+        SELECT c.id, c.chauffeur_id, c.nom_client, c.telephone_client,
+               c.adresse_pec, c.lieu_depose, c.heure_prevue, c.heure_pec_prevue,
+               c.temps_trajet_minutes, c.heure_depart_calculee, c.type_course,
+               c.tarif_estime, c.km_estime, c.commentaire, c.commentaire_chauffeur,
+               c.statut, c.date_confirmation, c.date_pec, c.date_depose,
+               c.created_by, c.client_regulier_id, c.visible_chauffeur,
+               c.km_reel, c.tarif_reel,
+               u.full_name as chauffeur_name
         FROM courses c
         JOIN users u ON c.chauffeur_id = u.id
         WHERE 1=1
@@ -445,110 +711,102 @@ def get_courses(chauffeur_id=None, date_filter=None, role=None, days_back=30, li
         if not show_all:
             if date_filter:
                 if isinstance(date_filter, datetime):
-                    param_date = date_filter.date().strftime('%Y-%m-%d')
+                    jour = date_filter.date()
                 else:
                     s = str(date_filter).strip()
                     s = s.replace('/', '-').replace('T', ' ')
                     try:
-                        dt = datetime.fromisoformat(s)
-                        param_date = dt.date().strftime('%Y-%m-%d')
+                        jour = datetime.fromisoformat(s).date()
                     except Exception:
-                        param_date = s[0:10]
-                query += " AND DATE(c.heure_prevue) = CAST(%s AS date)"
-                params.append(param_date)
+                        jour = date.fromisoformat(s[0:10])
+                # Intervalle semi-ouvert plutôt que DATE(heure_prevue) : utilise l'index sur heure_prevue.
+                # Bornes à minuit heure de Paris, pas minuit du fuseau du serveur
+                query += " AND c.heure_prevue >= %s AND c.heure_prevue < %s"
+                params.extend(paris_day_bounds(jour))
             else:
                 # Filtre par days_back seulement si show_all=False
-                date_limite = (datetime.now(TIMEZONE) - timedelta(days=days_back)).date()
-                param_date = date_limite.strftime("%Y-%m-%d")
-                query += " AND DATE(c. heure_prevue) >= CAST(%s AS date)"
-                params.append(param_date)
+                date_limite = (now_paris() - timedelta(days=days_back)).date()
+                query += " AND c.heure_prevue >= %s"
+                params.append(paris_day_bounds(date_limite)[0])
 
         if chauffeur_id:
             query += " AND c.chauffeur_id = %s"
             params.append(chauffeur_id)
 
+        if statut:
+            query += " AND c.statut = %s"
+            params.append(statut)
+
         if role == "chauffeur":
             query += " AND c.visible_chauffeur = true"
 
         query += """
             ORDER BY
-                DATE(c.heure_prevue) DESC,
+                (c.heure_prevue AT TIME ZONE 'Europe/Paris')::date DESC,
                 COALESCE(
                     c.heure_pec_prevue:: time,
                     (c. heure_prevue AT TIME ZONE 'Europe/Paris')::time
-                ) DESC
+                ) DESC,
+                c.id DESC
         """
         
         # ✅ Limite très élevée si show_all=True
-        if show_all:
-            query += " LIMIT 10000"
-        else:
-            query += f" LIMIT {limit}"
+        row_limit = 10000 if show_all else int(limit)
+        # LIMIT en paramètre : une seule requête préparée quelle que soit la limite
+        query += " LIMIT %s"
+        params.append(row_limit)
 
-        try:
-            cursor.execute(query, params)
-            courses = cursor.fetchall()
-        except Exception as e:
-            print("get_courses SQL error:", e)
-            print("SQL query:", query)
-            print("params:", params)
-            release_db_connection(conn)
-            return []
+        with db_cursor(dict_rows=False) if cursor is None else nullcontext(cursor) as cursor:
+            if cursor is None:
+                return []
+            execute_prepared(cursor, query, params)
+            courses = fetch_dicts(cursor)
 
     except Exception as e:
-        print("get_courses error:", e)
-        release_db_connection(conn)
+        if shared_cursor:
+            raise
+        logger.warning("get_courses : aucune course renvoyée (%s), params=%s", e, params)
         return []
 
-    release_db_connection(conn)
-
-    result = []
-    for course in courses:
-        result.append({
-            'id': course. get('id'),
-            'chauffeur_id': course.get('chauffeur_id'),
-            'nom_client': course.get('nom_client'),
-            'telephone_client': course.get('telephone_client'),
-            'adresse_pec': course.get('adresse_pec'),
-            'lieu_depose': course.get('lieu_depose'),
-            'heure_prevue': course.get('heure_prevue'),
-            'heure_pec_prevue': course.get('heure_pec_prevue'),
-            'temps_trajet_minutes': course.get('temps_trajet_minutes'),
-            'heure_depart_calculee': course.get('heure_depart_calculee'),
-            'type_course': course.get('type_course'),
-            'tarif_estime': course.get('tarif_estime'),
-            'km_estime': course.get('km_estime'),
-            'commentaire': course.get('commentaire'),
-            'commentaire_chauffeur': course.get('commentaire_chauffeur'),
-            'statut': course.get('statut'),
-            'date_creation': course.get('date_creation'),
-            'date_confirmation': course.get('date_confirmation'),
-            'date_pec': course.get('date_pec'),
-            'date_depose': course.get('date_depose'),
-            'created_by': course.get('created_by'),
-            'client_regulier_id': course.get('client_regulier_id'),
-            'chauffeur_name': course.get('chauffeur_name'),
-            'visible_chauffeur':  course.get('visible_chauffeur', True),
-            'km_reel': course.get('km_reel'),
-            'tarif_reel': course.get('tarif_reel')
-        })
-    return result
+    return courses
+
+def count_courses(days_back=30, show_all=False):
+    """Nombre de courses sans rapatrier les lignes : même fenêtre et même jointure
+    sur users que get_courses. Si show_all=True, aucune limite de date."""
+    query = 'SELECT COUNT(*) FROM courses c JOIN users u ON c.chauffeur_id = u.id'
+    params = ()
+    if not show_all:
+        date_limite = (now_paris() - timedelta(days=days_back)).date()
+        query += ' WHERE c.heure_prevue >= %s'
+        params = (paris_day_bounds(date_limite)[0],)
+    with db_cursor(dict_rows=False) as cursor:
+        if cursor is None:
+            return 0
+        execute_prepared(cursor, query, params)
+        return cursor.fetchone()[0]
+
+def chauffeur_page_data(chauffeur_id, date_filter=None):
+    """Notifications non lues et courses d'un chauffeur, lues sur une seule connexion."""
+    with db_cursor(dict_rows=False) as cursor:
+        if cursor is None:
+            return [], 0, []
+        notifications, unread_count = get_unread_notifications(chauffeur_id, cursor=cursor)
+        courses = get_courses(chauffeur_id=chauffeur_id, date_filter=date_filter, role='chauffeur', cursor=cursor)
+    return notifications, unread_count, courses
 
 def distribute_courses_for_date(date_str):
     try:
-        conn = get_db_connection()
-        if not conn:
-            return {'success': False, 'count': 0, 'message': "Erreur de connexion"}
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE courses
-            SET visible_chauffeur = true
-            WHERE DATE(heure_prevue AT TIME ZONE 'Europe/Paris') = %s
-            AND visible_chauffeur = false
-        ''', (date_str,))
-        count = cursor.rowcount
-        conn.commit()
-        release_db_connection(conn)
+        debut, fin = paris_day_bounds(date.fromisoformat(date_str))
+        with db_cursor() as cursor:
+            if cursor is None:
+                return {'success': False, 'count': 0, 'message': "Erreur de connexion"}
+            cursor.execute('''
+                UPDATE courses
+                SET visible_chauffeur = true
+                WHERE heure_prevue >= %s AND heure_prevue < %s
+                AND visible_chauffeur = false
+            ''', (debut, fin))
+            count = cursor.rowcount
         return {
             'success': True,
             'count': count,
@@ -561,83 +819,90 @@ def distribute_courses_for_date(date_str):
             'message': f"❌ Erreur :  {str(e)}"
         }
 
+# Colonnes SQL → en-têtes du fichier Excel, dans l'ordre d'affichage
+EXCEL_EXPORT_COLUMNS = {
+    'full_name': 'Chauffeur',
+    'nom_client': 'Client',
+    'telephone_client': 'Téléphone',
+    'adresse_pec': 'Adresse PEC',
+    'lieu_depose': 'Lieu dépose',
+    'heure_prevue': 'Date/Heure',
+    'heure_pec_prevue': 'Heure PEC',
+    'type_course': 'Type',
+    'tarif_estime': 'Tarif (€)',
+    'km_estime': 'Km',
+    'statut': 'Statut',
+    'commentaire': 'Commentaire secrétaire',
+    'commentaire_chauffeur': 'Commentaire chauffeur',
+    'date_confirmation': 'Date confirmation',
+    'date_pec': 'Date PEC réelle',
+    'date_depose': 'Date dépose',
+}
+
+EXCEL_DATE_COLUMNS = {'heure_prevue', 'date_confirmation', 'date_pec', 'date_depose'}
+
 def export_week_to_excel(week_start_date):
     try:
-        from io import BytesIO
-        from openpyxl. styles import Font, PatternFill, Alignment
-        conn = get_db_connection()
-        if not conn:
-            return {'success': False, 'error': 'Erreur de connexion'}
-        cursor = conn. cursor()
+        import xlsxwriter
         week_end_date = week_start_date + timedelta(days=6)
-        cursor.execute('''
-            SELECT 
-                u.full_name,
-                c.nom_client,
-                c.telephone_client,
-                c.adresse_pec,
-                c.lieu_depose,
-                c.heure_prevue,
-                c.heure_pec_prevue,
-                c.type_course,
-                c.tarif_estime,
-                c.km_estime,
-                c.statut,
-                c.commentaire,
-                c.commentaire_chauffeur,
-                c.date_confirmation,
-                c.date_pec,
-                c.date_depose
-            FROM courses c
-            JOIN users u ON c.chauffeur_id = u.id
-            WHERE c.heure_prevue >= %s AND c.heure_prevue < %s + INTERVAL '1 day'
-            ORDER BY c.heure_prevue
-        ''', (week_start_date, week_end_date))
-        rows = cursor.fetchall()
-        release_db_connection(conn)
-        if not rows or len(rows) == 0:
+        date_indexes = [i for i, column in enumerate(EXCEL_EXPORT_COLUMNS) if column in EXCEL_DATE_COLUMNS]
+        headers = list(EXCEL_EXPORT_COLUMNS.values())
+        widths = [len(header) for header in headers]
+        buffer = BytesIO()
+        # constant_memory : chaque ligne est écrite sur disque dès qu'elle est complète
+        workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Courses')
+        header_format = workbook.add_format({
+            'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#366092', 'align': 'center'
+        })
+        worksheet.write_row(0, 0, headers, header_format)
+        count = 0
+        with db_cursor(dict_rows=False, name='export_semaine') as cursor:
+            if cursor is None:
+                workbook.close()
+                return {'success': False, 'error': 'Erreur de connexion'}
+            cursor.itersize = 2000
+            cursor.execute('''
+                SELECT 
+                    u.full_name,
+                    c.nom_client,
+                    c.telephone_client,
+                    c.adresse_pec,
+                    c.lieu_depose,
+                    c.heure_prevue,
+                    c.heure_pec_prevue,
+                    c.type_course,
+                    c.tarif_estime,
+                    c.km_estime,
+                    c.statut,
+                    c.commentaire,
+                    c.commentaire_chauffeur,
+                    c.date_confirmation,
+                    c.date_pec,
+                    c.date_depose
+                FROM courses c
+                JOIN users u ON c.chauffeur_id = u.id
+                WHERE c.heure_prevue >= %s AND c.heure_prevue < %s
+                ORDER BY c.heure_prevue
+            ''', (paris_day_bounds(week_start_date)[0], paris_day_bounds(week_end_date)[1]))
+            for row in cursor:
+                count += 1
+                values = ['' if value is None else value for value in row]
+                for i in date_indexes:
+                    if isinstance(values[i], datetime):
+                        values[i] = format_datetime_fr(values[i])
+                worksheet.write_row(count, 0, values)
+                for i, value in enumerate(values):
+                    widths[i] = max(widths[i], len(str(value)))
+        if count == 0:
+            workbook.close()
             return {
                 'success': False,
                 'error': f'Aucune course trouvée pour la semaine du {week_start_date.strftime("%d/%m/%Y")} au {week_end_date. strftime("%d/%m/%Y")}'
             }
-        data = []
-        for row in rows:
-            data.append({
-                'Chauffeur': row['full_name'],
-                'Client': row['nom_client'],
-                'Téléphone': row['telephone_client'],
-                'Adresse PEC': row['adresse_pec'],
-                'Lieu dépose': row['lieu_depose'],
-                'Date/Heure': row['heure_prevue'],
-                'Heure PEC': row['heure_pec_prevue'],
-                'Type':  row['type_course'],
-                'Tarif (€)': row['tarif_estime'],
-                'Km':  row['km_estime'],
-                'Statut': row['statut'],
-                'Commentaire secrétaire': row['commentaire'],
-                'Commentaire chauffeur': row['commentaire_chauffeur'],
-                'Date confirmation': row['date_confirmation'],
-                'Date PEC réelle': row['date_pec'],
-                'Date dépose':  row['date_depose']
-            })
-        df = pd.DataFrame(data)
-        date_columns = ['Date/Heure', 'Date confirmation', 'Date PEC réelle', 'Date dépose']
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%d/%m/%Y %H:%M')
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Courses')
-            worksheet = writer.sheets['Courses']
-            for cell in worksheet[1]:
-                cell.font = Font(bold=True, color="FFFFFF")
-                cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center")
-            for i, col in enumerate(df.columns):
-                max_length = max(df[col].astype(str).apply(len).max(), len(col)) + 2
-                col_letter = chr(65 + i)
-                worksheet. column_dimensions[col_letter]. width = min(max_length, 50)
-        buffer.seek(0)
+        for i, width in enumerate(widths):
+            worksheet.set_column(i, i, min(width + 2, 50))
+        workbook.close()
         excel_data = buffer.getvalue()
         week_number = week_start_date.isocalendar()[1]
         year = week_start_date.year
@@ -645,7 +910,7 @@ def export_week_to_excel(week_start_date):
         return {
             'success': True,
             'excel_data': excel_data,
-            'count': len(df),
+            'count': count,
             'filename': filename
         }
     except Exception as e:
@@ -656,216 +921,245 @@ def export_week_to_excel(week_start_date):
 
 def purge_week_courses(week_start_date):
     try:
-        conn = get_db_connection()
-        if not conn:
-            return {'success': False, 'error': 'Erreur de connexion'}
-        cursor = conn.cursor()
         week_end_date = week_start_date + timedelta(days=6)
-        cursor.execute('''
-            SELECT id FROM courses
-            WHERE heure_prevue >= %s AND heure_prevue < %s + INTERVAL '1 day'
-        ''', (week_start_date, week_end_date))
-        course_ids = [row['id'] for row in cursor.fetchall()]
-        if not course_ids:
-            release_db_connection(conn)
-            return {'success': True, 'count': 0}
-        cursor.execute('''
-            DELETE FROM courses
-            WHERE id = ANY(%s)
-        ''', (course_ids,))
-        count = cursor.rowcount
-        conn.commit()
-        release_db_connection(conn)
+        with db_cursor(dict_rows=False) as cursor:
+            if cursor is None:
+                return {'success': False, 'error': 'Erreur de connexion'}
+            # Les notifications des courses purgées partent dans la même requête
+            cursor.execute('''
+                WITH deleted AS (
+                    DELETE FROM courses
+                    WHERE heure_prevue >= %s AND heure_prevue < %s
+                    RETURNING id
+                ), purged_notifications AS (
+                    DELETE FROM notifications n
+                    USING deleted d
+                    WHERE n.course_id = d.id
+                )
+                SELECT COUNT(*) FROM deleted
+            ''', (paris_day_bounds(week_start_date)[0], paris_day_bounds(week_end_date)[1]))
+            count = cursor.fetchone()[0]
         return {'success': True, 'count': count}
     except Exception as e:
         return {'success':  False, 'error': str(e)}
 
 def update_course_status(course_id, new_status, km_reel=None, tarif_reel=None):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    now_paris = datetime.now(TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
-    timestamp_field = {
-        'confirmee': 'date_confirmation',
-        'pec': 'date_pec',
-        'deposee': 'date_depose'
-    }
-    if new_status == 'deposee' and km_reel is not None and tarif_reel is not None:
-        cursor.execute('''
-            UPDATE courses
-            SET 
-                statut = %s, 
-                date_depose = %s,
-                km_reel = %s,
-                tarif_reel = %s
-            WHERE id = %s
-        ''', (new_status, now_paris, km_reel, tarif_reel, course_id))
-    elif new_status in timestamp_field:
-        cursor.execute(f'''
+    # Même texte que strftime('%Y-%m-%d %H:%M:%S'), sans analyser de format
+    horodatage = now_paris().replace(tzinfo=None).isoformat(sep=' ', timespec='seconds')
+    # Km/tarif réels uniquement à la dépose, et seulement s'ils sont fournis tous les deux
+    if new_status != 'deposee' or km_reel is None or tarif_reel is None:
+        km_reel = tarif_reel = None
+    with db_cursor() as cursor:
+        if cursor is None:
+            return False
+        # Une seule requête pour tous les statuts : l'horodatage ne touche que la colonne du statut
+        execute_prepared(cursor, '''
             UPDATE courses
-            SET statut = %s, {timestamp_field[new_status]} = %s
+            SET
+                statut = %s,
+                date_confirmation = CASE WHEN %s = 'confirmee' THEN %s ELSE date_confirmation END,
+                date_pec = CASE WHEN %s = 'pec' THEN %s ELSE date_pec END,
+                date_depose = CASE WHEN %s = 'deposee' THEN %s ELSE date_depose END,
+                km_reel = COALESCE(%s, km_reel),
+                tarif_reel = COALESCE(%s, tarif_reel)
             WHERE id = %s
-        ''', (new_status, now_paris, course_id))
-    else:
-        cursor.execute('''
-            UPDATE courses
-            SET statut = %s
-            WHERE id = %s
-        ''', (new_status, course_id))
-    conn.commit()
-    release_db_connection(conn)
+        ''', (
+            new_status,
+            new_status, horodatage,
+            new_status, horodatage,
+            new_status, horodatage,
+            km_reel,
+            tarif_reel,
+            course_id
+        ))
     return True
 
-def update_commentaire_chauffeur(course_id, commentaire):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE courses
-        SET commentaire_chauffeur = %s
-        WHERE id = %s
-    ''', (commentaire, course_id))
-    conn.commit()
-    release_db_connection(conn)
+# Colonnes que update_course_fields accepte (les noms sont insérés dans le SQL)
+COURSE_EDITABLE_FIELDS = frozenset({'commentaire_chauffeur', 'heure_pec_prevue', 'chauffeur_id'})
+
+@lru_cache(maxsize=32)
+def _update_course_sql(columns):
+    assignments = ', '.join(f'{column} = %s' for column in columns)
+    return f'UPDATE courses SET {assignments} WHERE id = %s'
+
+def update_course_fields(course_id, **fields):
+    """Met à jour les colonnes fournies d'une course : une requête préparée par jeu de colonnes."""
+    unknown = set(fields) - COURSE_EDITABLE_FIELDS
+    if unknown:
+        raise ValueError(f"Colonnes non modifiables : {', '.join(sorted(unknown))}")
+    if not fields:
+        return True
+    columns = tuple(sorted(fields))
+    with db_cursor() as cursor:
+        if cursor is None:
+            return False
+        execute_prepared(cursor, _update_course_sql(columns), (*(fields[c] for c in columns), course_id))
     return True
 
+def update_commentaire_chauffeur(course_id, commentaire):
+    return update_course_fields(course_id, commentaire_chauffeur=commentaire)
+
 def update_heure_pec_prevue(course_id, nouvelle_heure):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE courses
-        SET heure_pec_prevue = %s
-        WHERE id = %s
-    ''', (nouvelle_heure, course_id))
-    conn.commit()
-    release_db_connection(conn)
-    return True
+    return update_course_fields(course_id, heure_pec_prevue=nouvelle_heure)
 
 def delete_course(course_id):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    cursor.execute('''
-        DELETE FROM courses
-        WHERE id = %s
-    ''', (course_id,))
-    conn.commit()
-    release_db_connection(conn)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return False
+        execute_prepared(cursor, '''
+            DELETE FROM courses
+            WHERE id = %s
+        ''', (course_id,))
     return True
 
 def update_course_details(course_id, nouvelle_heure_pec, nouveau_chauffeur_id):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE courses
-        SET heure_pec_prevue = %s, chauffeur_id = %s
-        WHERE id = %s
-    ''', (nouvelle_heure_pec, nouveau_chauffeur_id, course_id))
-    conn.commit()
-    release_db_connection(conn)
-    return True
+    return update_course_fields(course_id, heure_pec_prevue=nouvelle_heure_pec, chauffeur_id=nouveau_chauffeur_id)
 
 def create_user(username, password, role, full_name):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    cursor = conn.cursor()
     hashed_password = hash_password(password)
     try:
-        cursor.execute('''
-            INSERT INTO users (username, password_hash, role, full_name)
-            VALUES (%s, %s, %s, %s)
-        ''', (username, hashed_password, role, full_name))
-        conn.commit()
-        release_db_connection(conn)
-        return True
+        with db_cursor() as cursor:
+            if cursor is None:
+                return False
+            cursor.execute('''
+                INSERT INTO users (username, password_hash, role, full_name)
+                VALUES (%s, %s, %s, %s)
+            ''', (username, hashed_password, role, full_name))
     except psycopg2.IntegrityError:
-        release_db_connection(conn)
         return False
+    clear_users_cache()
+    return True
 
 def delete_user(user_id):
-    conn = get_db_connection()
-    if not conn:
-        return False, "Erreur de connexion"
-    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
-        admin_count = get_scalar_result(cursor)
-        cursor.execute("SELECT role FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        if user and user['role'] == 'admin' and admin_count <= 1:
-            release_db_connection(conn)
-            return False, "Impossible de supprimer le dernier administrateur"
-        cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
-        conn.commit()
-        release_db_connection(conn)
-        return True, "Utilisateur supprimé avec succès"
+        with db_cursor(dict_rows=False) as cursor:
+            if cursor is None:
+                return False, "Erreur de connexion"
+            # Contrôle « dernier admin » et suppression en une seule requête
+            cursor.execute('''
+                WITH target AS (SELECT id, role FROM users WHERE id = %s),
+                     guard AS (SELECT COUNT(*) AS admins FROM users WHERE role = 'admin'),
+                     deleted AS (
+                         DELETE FROM users u
+                         USING target t, guard g
+                         WHERE u.id = t.id AND NOT (t.role = 'admin' AND g.admins <= 1)
+                         RETURNING u.id
+                     )
+                SELECT (SELECT role FROM target), (SELECT COUNT(*) FROM deleted)
+            ''', (user_id,))
+            role, deleted = cursor.fetchone()
+            if role == 'admin' and not deleted:
+                return False, "Impossible de supprimer le dernier administrateur"
     except Exception as e:
-        release_db_connection(conn)
+        logger.exception("delete_user a échoué user_id=%s", user_id)
         return False, f"Erreur:  {str(e)}"
+    clear_users_cache()
+    return True, "Utilisateur supprimé avec succès"
 
+@st.cache_data(ttl=60, show_spinner=False)
 def get_all_users():
-    conn = get_db_connection()
-    if not conn:
-        return []
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, username, role, full_name, created_at
-        FROM users
-        ORDER BY role, full_name
-    ''')
-    users = cursor.fetchall()
-    release_db_connection(conn)
-    return users
+    with db_cursor() as cursor:
+        if cursor is None:
+            return []
+        cursor.execute('''
+            SELECT id, username, role, full_name, created_at
+            FROM users
+            ORDER BY role, full_name
+        ''')
+        users = cursor.fetchall()
+    return [dict(u) for u in users]
+
+def get_driver_day_load(jour):
+    """Nombre de courses et dernier lieu de dépose de chaque chauffeur pour un jour."""
+    with db_cursor() as cursor:
+        if cursor is None:
+            return {}
+        cursor.execute('''
+            SELECT c.chauffeur_id,
+                   COUNT(*) AS courses_today,
+                   (ARRAY_AGG(c.lieu_depose ORDER BY c.heure_prevue DESC))[1] AS last_depose
+            FROM courses c
+            WHERE c.heure_prevue >= %s AND c.heure_prevue < %s
+            GROUP BY c.chauffeur_id
+        ''', paris_day_bounds(jour))
+        rows = cursor.fetchall()
+    return {row['chauffeur_id']: dict(row) for row in rows}
+
+@st.cache_data(ttl=15, show_spinner=False)
+def dashboard_counts():
+    """Statistiques du tableau de bord admin en une seule requête."""
+    with db_cursor() as cursor:
+        if cursor is None:
+            return None
+        cursor.execute('''
+            SELECT
+                COUNT(*) AS total_courses,
+                COUNT(*) FILTER (WHERE statut = 'deposee') AS courses_terminees,
+                COUNT(*) FILTER (WHERE statut IN ('nouvelle', 'confirmee', 'pec')) AS courses_en_cours,
+                COALESCE(SUM(tarif_estime) FILTER (WHERE statut = 'deposee'), 0) AS ca_total
+            FROM courses
+        ''')
+        return dict(cursor.fetchone())
+
+def clear_users_cache():
+    get_chauffeurs.clear()
+    get_all_users.clear()
 
 def reassign_course_to_driver(course_id, new_chauffeur_id):
-    conn = get_db_connection()
-    if not conn:
-        return {'success': False, 'error':  'Erreur de connexion'}
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT c.chauffeur_id, c.nom_client, u.full_name 
-        FROM courses c
-        JOIN users u ON c.chauffeur_id = u.id
-        WHERE c.id = %s
-    ''', (course_id,))
-    result = cursor.fetchone()
-    if result:
-        old_chauffeur_id, nom_client, old_chauffeur_name = result['chauffeur_id'], result['nom_client'], result['full_name']
-        cursor.execute('SELECT full_name FROM users WHERE id = %s', (new_chauffeur_id,))
-        new_chauffeur_name = get_scalar_result(cursor)
+    with db_cursor() as cursor:
+        if cursor is None:
+            return {'success': False, 'error':  'Erreur de connexion'}
+        # Une seule requête : les jointures lisent l'ancien chauffeur avant la mise à jour
+        execute_prepared(cursor, '''
+            UPDATE courses c
+            SET chauffeur_id = new_u.id
+            FROM users old_u, users new_u
+            WHERE c.id = %s AND old_u.id = c.chauffeur_id AND new_u.id = %s
+            RETURNING c.nom_client, old_u.id AS old_id, old_u.full_name AS old_name,
+                      new_u.full_name AS new_name
+        ''', (course_id, new_chauffeur_id))
+        result = cursor.fetchone()
+        if not result:
+            return {'success': False, 'error': 'Course non trouvée'}
+        old_chauffeur_id, nom_client = result['old_id'], result['nom_client']
+        old_chauffeur_name, new_chauffeur_name = result['old_name'], result['new_name']
+    return {
+        'success': True,
+        'course_id': course_id,
+        'nom_client': nom_client,
+        'old_chauffeur_id': old_chauffeur_id,
+        'old_chauffeur_name': old_chauffeur_name,
+        'new_chauffeur_id': new_chauffeur_id,
+        'new_chauffeur_name':  new_chauffeur_name
+    }
+
+def reassign_courses_to_driver(course_ids, new_chauffeur_id):
+    """Réattribue plusieurs courses en un seul UPDATE. Renvoie le nombre de courses modifiées."""
+    if not course_ids:
+        return 0
+    with db_cursor() as cursor:
+        if cursor is None:
+            return 0
         cursor.execute('''
-            UPDATE courses 
+            UPDATE courses
             SET chauffeur_id = %s
-            WHERE id = %s
-        ''', (new_chauffeur_id, course_id))
-        conn.commit()
-        release_db_connection(conn)
-        return {
-            'success': True,
-            'course_id': course_id,
-            'nom_client': nom_client,
-            'old_chauffeur_id': old_chauffeur_id,
-            'old_chauffeur_name': old_chauffeur_name,
-            'new_chauffeur_id': new_chauffeur_id,
-            'new_chauffeur_name':  new_chauffeur_name
-        }
-    else:
-        release_db_connection(conn)
-        return {'success': False, 'error': 'Course non trouvée'}
+            WHERE id = ANY(%s)
+        ''', (new_chauffeur_id, list(course_ids)))
+        return cursor.rowcount
 
 
 # ============================================
 # INTERFACES UTILISATEUR
 # ============================================
 
+ARCHIVE_STATE_KEYS = ('week_archived', 'archive_filename', 'archive_excel_data', 'archive_count', 'confirm_delete_week')
+ASSISTANT_STATE_KEYS = ('assistant_suggestions', 'assistant_course_data')
+
+def logout():
+    # Vide toute la session : rien ne doit survivre pour l'utilisateur suivant
+    st.session_state.clear()
+    st.rerun()
+
 def login_page():
     st.title("Transport DanGE - Planning des courses")
     st.markdown("---")
@@ -881,6 +1175,77 @@ def login_page():
                 st.rerun()
             else:
                 st.error("Nom d'utilisateur ou mot de passe incorrect")
+def admin_planning_panel():
+    """Onglet Planning Global admin : filtres et liste, relancés seuls (fragment)."""
+    st.subheader("Planning Global de toutes les courses")
+    # Une seule lecture des chauffeurs pour le filtre et sa résolution
+    chauffeurs = get_chauffeurs()
+    chauffeur_ids = _chauffeur_index(chauffeurs)
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        show_all = st.checkbox("Afficher toutes les courses", value=True)
+        if not show_all:
+            date_filter = st.date_input("Filtrer par date", value=today_paris())
+        else:
+            date_filter = None
+    with col2:
+        chauffeur_filter = st.selectbox("Filtrer par chauffeur", ["Tous"] + [c['full_name'] for c in chauffeurs])
+    with col3:
+        statut_filter = st.selectbox("Filtrer par statut", ["Tous", *STATUTS_COURSE])
+    with col4:
+        st.metric("Total courses", count_courses())
+    
+    chauffeur_id = None
+    if chauffeur_filter != "Tous":
+        chauffeur_id = chauffeur_ids.get(chauffeur_filter)
+    
+    date_filter_str = None
+    if not show_all and date_filter: 
+        date_filter_str = date_filter.strftime('%Y-%m-%d')
+    
+    courses = get_courses(chauffeur_id=chauffeur_id, date_filter=date_filter_str, statut=STATUTS_COURSE.get(statut_filter))
+    
+    st.info(f"📊 {len(courses)} course(s) trouvée(s)")
+    
+    if courses: 
+        for course in courses:
+            date_fr = format_date_fr(course['heure_prevue'])
+            heure_affichage = course.get('heure_pec_prevue') or extract_time_str(course['heure_prevue'])
+            titre_course = f"{STATUT_EMOJIS.get(course['statut'], '⚪')} {date_fr} {heure_affichage} - {course['nom_client']} ({course['chauffeur_name']})"
+            
+            with st.expander(titre_course):
+                col1, col2 = st. columns(2)
+                with col1:
+                    st. write(f"**Client :** {course['nom_client']}")
+                    st.write(f"**Téléphone :** {course['telephone_client']}")
+                    st.write(f"**📅 Date PEC :** {date_fr}")
+                    if course. get('heure_pec_prevue'):
+                        st.success(f"⏰ **Heure PEC prévue :  {course['heure_pec_prevue']}**")
+                    st.write(f"**PEC :** {course['adresse_pec']}")
+                    st.write(f"**Dépose :** {course['lieu_depose']}")
+                    st.write(f"**Type :** {course['type_course']}")
+                with col2:
+                    st. write(f"**Chauffeur :** {course['chauffeur_name']}")
+                    st.write(f"**Tarif estimé :** {course['tarif_estime']}€")
+                    st.write(f"**Km estimé :** {course['km_estime']} km")
+                    st.write(f"**Statut :** {course['statut']. upper()}")
+                    if course['commentaire']:
+                        st. write(f"**Commentaire secrétaire :** {course['commentaire']}")
+                
+                if course.get('commentaire_chauffeur'):
+                    st. warning(f"💭 **Commentaire chauffeur** : {course['commentaire_chauffeur']}")
+                
+                if course['date_confirmation']:
+                    st. info(f"✅ Confirmée le : {format_datetime_fr(course['date_confirmation'])}")
+                if course['date_pec']: 
+                    st.info(f"📍 PEC effectuée le : {format_datetime_fr(course['date_pec'])}")
+                if course['date_depose']:
+                    st.success(f"🏁 Déposée le :  {format_datetime_fr(course['date_depose'])}")
+    else:
+        st.info("Aucune course pour cette sélection")
+
+
 def admin_page():
     st.title("🔧 Administration - Transport DanGE")
     st.markdown(f"**Connecté en tant que :** {st.session_state. user['full_name']} (Admin)")
@@ -889,9 +1254,7 @@ def admin_page():
     
     with col_deconnexion:
         if st.button("🚪 Déconnexion"):
-            if "user" in st.session_state:
-                del st.session_state.user
-            st.rerun()
+            logout()
     with col_refresh:
         if st.button("🔄 Actualiser"):
             st.rerun()
@@ -901,88 +1264,7 @@ def admin_page():
     tab1, tab2, tab3, tab4 = st.tabs(["📊 Planning Global", "👥 Gestion des Comptes", "📈 Statistiques", "💾 Export"])
     
     with tab1:
-        st.subheader("Planning Global de toutes les courses")
-        
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            show_all = st.checkbox("Afficher toutes les courses", value=True)
-            if not show_all:
-                date_filter = st.date_input("Filtrer par date", value=datetime.now())
-            else:
-                date_filter = None
-        with col2:
-            chauffeur_filter = st.selectbox("Filtrer par chauffeur", ["Tous"] + [c['full_name'] for c in get_chauffeurs()])
-        with col3:
-            statut_filter = st.selectbox("Filtrer par statut", ["Tous", "Nouvelle", "Confirmée", "PEC", "Déposée"])
-        with col4:
-            st.metric("Total courses", len(get_courses()))
-        
-        chauffeur_id = None
-        if chauffeur_filter != "Tous":
-            chauffeurs = get_chauffeurs()
-            for c in chauffeurs:
-                if c['full_name'] == chauffeur_filter:
-                    chauffeur_id = c['id']
-                    break
-        
-        date_filter_str = None
-        if not show_all and date_filter: 
-            date_filter_str = date_filter.strftime('%Y-%m-%d')
-        
-        courses = get_courses(chauffeur_id=chauffeur_id, date_filter=date_filter_str)
-        
-        st.info(f"📊 {len(courses)} course(s) trouvée(s)")
-        
-        if courses: 
-            for course in courses:
-                statut_mapping = {'Nouvelle': 'nouvelle', 'Confirmée': 'confirmee', 'PEC': 'pec', 'Déposée': 'deposee'}
-                
-                if statut_filter != "Tous":
-                    statut_reel = statut_mapping. get(statut_filter, statut_filter. lower())
-                    if course['statut']. lower() != statut_reel. lower():
-                        continue
-                
-                statut_colors = {
-                    'nouvelle': '🔵',
-                    'confirmee': '🟡',
-                    'pec':  '🔴',
-                    'deposee': '🟢'
-                }
-                
-                date_fr = format_date_fr(course['heure_prevue'])
-                heure_affichage = course. get('heure_pec_prevue', extract_time_str(course['heure_prevue']))
-                titre_course = f"{statut_colors. get(course['statut'], '⚪')} {date_fr} {heure_affichage} - {course['nom_client']} ({course['chauffeur_name']})"
-                
-                with st.expander(titre_course):
-                    col1, col2 = st. columns(2)
-                    with col1:
-                        st. write(f"**Client :** {course['nom_client']}")
-                        st.write(f"**Téléphone :** {course['telephone_client']}")
-                        st.write(f"**📅 Date PEC :** {format_date_fr(course['heure_prevue'])}")
-                        if course. get('heure_pec_prevue'):
-                            st.success(f"⏰ **Heure PEC prévue :  {course['heure_pec_prevue']}**")
-                        st.write(f"**PEC :** {course['adresse_pec']}")
-                        st.write(f"**Dépose :** {course['lieu_depose']}")
-                        st.write(f"**Type :** {course['type_course']}")
-                    with col2:
-                        st. write(f"**Chauffeur :** {course['chauffeur_name']}")
-                        st.write(f"**Tarif estimé :** {course['tarif_estime']}€")
-                        st.write(f"**Km estimé :** {course['km_estime']} km")
-                        st.write(f"**Statut :** {course['statut']. upper()}")
-                        if course['commentaire']:
-                            st. write(f"**Commentaire secrétaire :** {course['commentaire']}")
-                    
-                    if course.get('commentaire_chauffeur'):
-                        st. warning(f"💭 **Commentaire chauffeur** : {course['commentaire_chauffeur']}")
-                    
-                    if course['date_confirmation']:
-                        st. info(f"✅ Confirmée le : {format_datetime_fr(course['date_confirmation'])}")
-                    if course['date_pec']: 
-                        st.info(f"📍 PEC effectuée le : {format_datetime_fr(course['date_pec'])}")
-                    if course['date_depose']:
-                        st.success(f"🏁 Déposée le :  {format_datetime_fr(course['date_depose'])}")
-        else:
-            st.info("Aucune course pour cette sélection")
+        run_in_fragment(admin_planning_panel)
     
     with tab2:
         st.subheader("Gestion des comptes utilisateurs")
@@ -1031,69 +1313,66 @@ def admin_page():
     with tab3:
         st.subheader("📈 Statistiques")
         
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            
+        stats = dashboard_counts()
+        if stats:
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                cursor.execute("SELECT COUNT(*) FROM courses")
-                total_courses = get_scalar_result(cursor)
-                st.metric("Total courses", total_courses)
+                st.metric("Total courses", stats['total_courses'])
             
             with col2:
-                cursor.execute("SELECT COUNT(*) FROM courses WHERE statut = 'deposee'")
-                courses_terminees = get_scalar_result(cursor)
-                st.metric("Courses terminées", courses_terminees)
+                st.metric("Courses terminées", stats['courses_terminees'])
             
             with col3:
-                cursor.execute("SELECT COUNT(*) FROM courses WHERE statut IN ('nouvelle', 'confirmee', 'pec')")
-                courses_en_cours = get_scalar_result(cursor)
-                st.metric("Courses en cours", courses_en_cours)
+                st.metric("Courses en cours", stats['courses_en_cours'])
             
             with col4:
-                cursor. execute("SELECT SUM(tarif_estime) FROM courses WHERE statut = 'deposee'")
-                ca_total = get_scalar_result(cursor) or 0
-                st.metric("CA réalisé", f"{ca_total:.2f}€")
-            
-            release_db_connection(conn)
+                st.metric("CA réalisé", f"{stats['ca_total']:.2f}€")
     
     with tab4:
         st.subheader("💾 Export des données")
         st.write("Exporter les courses en CSV pour analyse ou comptabilité")
         
-        export_date_debut = st.date_input("Date de début", value=datetime.now() - timedelta(days=30))
-        export_date_fin = st.date_input("Date de fin", value=datetime.now())
+        export_date_debut = st.date_input("Date de début", value=today_paris() - timedelta(days=30))
+        export_date_fin = st.date_input("Date de fin", value=today_paris())
         
         if st. button("Exporter en CSV"):
-            conn = get_db_connection()
-            if conn:
-                query = '''
-                    SELECT 
-                        c.id,
-                        c.heure_prevue as "Date/Heure",
-                        u.full_name as "Chauffeur",
-                        c. nom_client as "Client",
-                        c.telephone_client as "Téléphone",
-                        c.adresse_pec as "Adresse PEC",
-                        c.lieu_depose as "Lieu dépose",
-                        c.type_course as "Type",
-                        c.tarif_estime as "Tarif",
-                        c.km_estime as "Km",
-                        c.statut as "Statut",
-                        c. date_confirmation as "Date confirmation",
-                        c.date_pec as "Date PEC",
-                        c.date_depose as "Date dépose"
-                    FROM courses c
-                    JOIN users u ON c.chauffeur_id = u.id
-                    WHERE DATE(c.heure_prevue) BETWEEN %s AND %s
-                    ORDER BY c.heure_prevue
-                '''
-                df = pd.read_sql_query(query, conn, params=(export_date_debut, export_date_fin))
-                release_db_connection(conn)
-                
-                csv = df.to_csv(index=False).encode('utf-8-sig')
+            query = '''
+                SELECT 
+                    c.id,
+                    c.heure_prevue as "Date/Heure",
+                    u.full_name as "Chauffeur",
+                    c. nom_client as "Client",
+                    c.telephone_client as "Téléphone",
+                    c.adresse_pec as "Adresse PEC",
+                    c.lieu_depose as "Lieu dépose",
+                    c.type_course as "Type",
+                    c.tarif_estime as "Tarif",
+                    c.km_estime as "Km",
+                    c.statut as "Statut",
+                    c. date_confirmation as "Date confirmation",
+                    c.date_pec as "Date PEC",
+                    c.date_depose as "Date dépose"
+                FROM courses c
+                JOIN users u ON c.chauffeur_id = u.id
+                WHERE c.heure_prevue >= %s AND c.heure_prevue < %s
+                ORDER BY c.heure_prevue
+            '''
+            # Du début du premier jour à minuit après le dernier, heure de Paris : utilise l'index sur heure_prevue
+            bornes = (paris_day_bounds(export_date_debut)[0], paris_day_bounds(export_date_fin)[1])
+            csv = None
+            # COPY : PostgreSQL produit directement le CSV, sans DataFrame intermédiaire
+            with db_cursor(dict_rows=False) as cursor:
+                if cursor is not None:
+                    buffer = BytesIO()
+                    buffer.write('\ufeff'.encode('utf-8'))  # BOM : accents lus correctement par Excel
+                    # Dates du CSV en heure de Paris, limité à cette transaction (compatible pooler)
+                    cursor.execute("SET LOCAL TIME ZONE 'Europe/Paris'")
+                    copy_sql = f"COPY ({cursor.mogrify(query, bornes).decode()}) TO STDOUT WITH (FORMAT csv, HEADER, ENCODING 'UTF8')"
+                    cursor.copy_expert(copy_sql, buffer)
+                    csv = buffer.getvalue()
+            
+            if csv is not None:
                 st.download_button(
                     label="📥 Télécharger le CSV",
                     data=csv,
@@ -1102,6 +1381,149 @@ def admin_page():
                 )
 
 
+def secretaire_planning_panel():
+    """Onglet Planning Global secrétaire : filtres et liste, relancés seuls (fragment)."""
+    st.subheader("Planning Global")
+    # Une seule lecture des chauffeurs pour le filtre, sa résolution et les formulaires de modification
+    chauffeurs = get_chauffeurs()
+    chauffeur_ids = _chauffeur_index(chauffeurs)
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        show_all_sec = st.checkbox("Toutes les courses", value=True, key="sec_show_all")
+        if not show_all_sec:
+            date_filter = st.date_input("Date", value=today_paris(), key="sec_date")
+        else:
+            date_filter = None
+    with col2:
+        chauffeur_filter = st.selectbox("Chauffeur", ["Tous"] + [c['full_name'] for c in chauffeurs], key="sec_chauff")
+    with col3:
+        statut_filter = st.selectbox("Statut", ["Tous", *STATUTS_COURSE], key="sec_statut")
+    with col4:
+        if show_all_sec:
+            total_courses = count_courses(show_all=True)
+        else:
+            total_courses = count_courses()
+        st.metric("Total", total_courses)
+    
+    chauffeur_id = None
+    if chauffeur_filter != "Tous":
+        chauffeur_id = chauffeur_ids.get(chauffeur_filter)
+    
+    date_filter_str = None
+    if not show_all_sec and date_filter:
+        date_filter_str = date_filter.strftime('%Y-%m-%d')
+    
+    if show_all_sec: 
+        st.info(f"📅 Affichage de TOUTES les courses (sans limite de date)")
+        courses = get_courses(show_all=True, statut=STATUTS_COURSE.get(statut_filter))  # Sans chauffeur_id
+    else:
+        date_filter_str = date_filter.strftime('%Y-%m-%d')
+        st.info(f"📅 Courses du {date_filter.strftime('%d/%m/%Y')}")
+        courses = get_courses(chauffeur_id=chauffeur_id, date_filter=date_filter_str, statut=STATUTS_COURSE.get(statut_filter))
+    
+    st.info(f"📊 {len(courses)} course(s)")
+    
+    if courses:
+        for course in courses:
+            date_fr = format_date_fr(course['heure_prevue'])
+            heure_affichage = course.get('heure_pec_prevue') or extract_time_str(course['heure_prevue'])
+            titre = f"{STATUT_EMOJIS.get(course['statut'], '⚪')} {date_fr} {heure_affichage} - {course['nom_client']} ({course['chauffeur_name']})"
+            
+            with st.expander(titre):
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.write(f"**Client :** {course['nom_client']}")
+                    st.write(f"**Tel :** {course['telephone_client']}")
+                    st.write(f"**PEC :** {course['adresse_pec']}")
+                    st.write(f"**Dépose :** {course['lieu_depose']}")
+                with col2:
+                    st.write(f"**Chauffeur :** {course['chauffeur_name']}")
+                    st.write(f"**Tarif :** {course['tarif_estime']}€")
+                    st. write(f"**Km :** {course['km_estime']} km")
+                
+                if course.get('commentaire_chauffeur'):
+                    st. warning(f"💭 {course['commentaire_chauffeur']}")
+                
+                st.markdown("---")
+                
+                col_btn1, col_btn2 = st.columns(2)
+                
+                with col_btn1:
+                    if st.button(f"🗑️ Supprimer", key=f"del_sec_{course['id']}", use_container_width=True):
+                        st.session_state[f'confirmer_suppression_{course["id"]}'] = True
+                
+                with col_btn2:
+                    if st.button(f"✏️ Modifier", key=f"mod_sec_{course['id']}", use_container_width=True):
+                        st.session_state[f'modifier_course_{course["id"]}'] = True
+                
+                if st.session_state.get(f'confirmer_suppression_{course["id"]}', False):
+                    st.markdown("---")
+                    st.warning("⚠️ Confirmer la suppression ? ")
+                    
+                    col_conf1, col_conf2 = st.columns(2)
+                    with col_conf1:
+                        if st.button("❌ Annuler", key=f"cancel_del_{course['id']}", use_container_width=True):
+                            del st.session_state[f'confirmer_suppression_{course["id"]}']
+                            rerun_fragment()
+                    with col_conf2:
+                        if st.button("✅ Confirmer", key=f"confirm_del_{course['id']}", use_container_width=True):
+                            delete_course(course['id'])
+                            del st.session_state[f'confirmer_suppression_{course["id"]}']
+                            st.rerun()
+                
+                if st.session_state.get(f'modifier_course_{course["id"]}', False):
+                    st. markdown("---")
+                    st.subheader("✏️ Modifier")
+                    
+                    chauffeurs_list = chauffeurs
+                    
+                    heure_actuelle = course.get('heure_pec_prevue', '')
+                    nouvelle_heure_pec = st.text_input(
+                        "Heure PEC (HH:MM)",
+                        value=heure_actuelle,
+                        key=f"input_heure_mod_{course['id']}"
+                    )
+                    
+                    chauffeur_actuel_index = 0
+                    for i, ch in enumerate(chauffeurs_list):
+                        if ch['id'] == course['chauffeur_id']: 
+                            chauffeur_actuel_index = i
+                            break
+                    
+                    nouveau_chauffeur = st.selectbox(
+                        "Chauffeur",
+                        options=chauffeurs_list,
+                        format_func=lambda x:  x['full_name'],
+                        index=chauffeur_actuel_index,
+                        key=f"select_chauffeur_mod_{course['id']}"
+                    )
+                    
+                    col_save, col_cancel = st.columns(2)
+                    with col_save: 
+                        if st.button("💾 Enregistrer", key=f"save_mod_{course['id']}", use_container_width=True):
+                            heure_valide = True
+                            nouvelle_heure_normalisee = None
+                            
+                            if nouvelle_heure_pec:
+                                nouvelle_heure_normalisee = normalize_hhmm(nouvelle_heure_pec)
+                                if nouvelle_heure_normalisee is None:
+                                    st.error("❌ Format invalide (HH:MM)")
+                                    heure_valide = False
+                            
+                            if heure_valide:
+                                update_course_details(course['id'], nouvelle_heure_normalisee, nouveau_chauffeur['id'])
+                                del st.session_state[f'modifier_course_{course["id"]}']
+                                st.rerun()
+                    
+                    with col_cancel:
+                        if st.button("❌ Annuler", key=f"cancel_mod_{course['id']}", use_container_width=True):
+                            del st.session_state[f'modifier_course_{course["id"]}']
+                            rerun_fragment()
+    else:
+        st.info("Aucune course")
+
+
 def secretaire_page():
     """Interface Secrétaire - Gestion complète du planning"""
     st.title("📝 Secrétariat - Planning des courses")
@@ -1111,9 +1533,7 @@ def secretaire_page():
     
     with col_deconnexion:
         if st.button("🚪 Déconnexion"):
-            if "user" in st.session_state:
-                del st.session_state.user
-            st.rerun()
+            logout()
     with col_refresh:
         if st.button("🔄 Actualiser"):
             st.rerun()
@@ -1199,7 +1619,8 @@ def secretaire_page():
                 col1, col2 = st.columns(2)
                 
                 with col1:
-                    chauffeur_names = [c['full_name'] for c in chauffeurs]
+                    chauffeur_ids = _chauffeur_index(chauffeurs)
+                    chauffeur_names = list(chauffeur_ids)
                     selected_chauffeur = st.selectbox("Chauffeur *", chauffeur_names)
                     
                     # Pré-remplissage
@@ -1241,8 +1662,7 @@ def secretaire_page():
                         default_km = 0.0
                         default_heure_pec = ''
                     
-                    now_paris = datetime.now(TIMEZONE)
-                    date_course = st.date_input("Date *", value=now_paris.date())
+                    date_course = st.date_input("Date *", value=today_paris())
                     heure_pec_prevue = st.text_input("Heure PEC (HH:MM)", value=default_heure_pec, placeholder="Ex: 17:50")
                     
                     type_course = st.selectbox("Type *", ["CPAM", "Privé"], index=0 if default_type == "CPAM" else 1)
@@ -1257,15 +1677,14 @@ def secretaire_page():
                 submitted = st.form_submit_button("✅ Créer la course", use_container_width=True)
                 
                 if submitted:
-                    if nom_client and adresse_pec and lieu_depose and selected_chauffeur:
-                        chauffeur_id = None
-                        for c in chauffeurs:
-                            if c['full_name'] == selected_chauffeur:
-                                chauffeur_id = c['id']
-                                break
+                    heure_pec_normalisee = normalize_hhmm(heure_pec_prevue)
+                    if heure_pec_prevue and heure_pec_normalisee is None:
+                        st.error("❌ Heure PEC invalide (format HH:MM)")
+                    elif nom_client and adresse_pec and lieu_depose and selected_chauffeur:
+                        chauffeur_id = chauffeur_ids.get(selected_chauffeur)
                         
                         if chauffeur_id:
-                            client_id = None
+                            client_data = None
                             if sauvegarder_client and not client_selectionne:
                                 client_data = {
                                     'nom_complet': nom_client,
@@ -1277,11 +1696,8 @@ def secretaire_page():
                                     'km_habituels': km_estime,
                                     'remarques': commentaire
                                 }
-                                client_id = create_client_regulier(client_data)
-                            elif client_selectionne:
-                                client_id = client_selectionne['id']
                             
-                            heure_prevue_naive = datetime.combine(date_course, datetime.now(TIMEZONE).time())
+                            heure_prevue_naive = datetime.combine(date_course, now_paris().time())
                             heure_prevue = heure_prevue_naive.strftime('%Y-%m-%d %H:%M:%S')
                             
                             course_data = {
@@ -1291,16 +1707,22 @@ def secretaire_page():
                                 'adresse_pec': adresse_pec,
                                 'lieu_depose': lieu_depose,
                                 'heure_prevue': heure_prevue,
-                                'heure_pec_prevue': heure_pec_prevue if heure_pec_prevue else None,
+                                'heure_pec_prevue': heure_pec_normalisee,
                                 'type_course': type_course,
                                 'tarif_estime': tarif_estime,
                                 'km_estime': km_estime,
                                 'commentaire': commentaire,
                                 'created_by': st.session_state.user['id'],
-                                'client_regulier_id': client_id
+                                'client_regulier_id': client_selectionne['id'] if client_selectionne else None
                             }
                             
-                            course_id = create_course(course_data)
+                            # Client régulier et course dans la même transaction : un seul commit
+                            with db_cursor(dict_rows=False) as cursor:
+                                if client_data:
+                                    course_data['client_regulier_id'] = create_client_regulier(client_data, cursor=cursor)
+                                course_id = create_course(course_data, cursor=cursor)
+                            if client_data:
+                                get_clients_reguliers.clear()
                             if course_id:
                                 st.success(f"✅ Course créée pour {selected_chauffeur}")
                                 st.success(f"✅ Course créée pour {selected_chauffeur}")
@@ -1313,7 +1735,7 @@ def secretaire_page():
                                     "nom_client": nom_client,
                                     "adresse_pec": adresse_pec,
                                     "lieu_depose": lieu_depose,
-                                    "heure_pec": heure_pec_prevue if heure_pec_prevue else "N/A",
+                                    "heure_pec": heure_pec_normalisee or "N/A",
                                     "tarif": tarif_estime,
                                     "km": km_estime
                                 }
@@ -1329,173 +1751,8 @@ def secretaire_page():
                         st.error("Remplissez tous les champs obligatoires (*)")
     
     with tab2:
-        st.subheader("Planning Global")
-        
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            show_all_sec = st.checkbox("Toutes les courses", value=True, key="sec_show_all")
-            if not show_all_sec:
-                date_filter = st.date_input("Date", value=datetime.now(), key="sec_date")
-            else:
-                date_filter = None
-        with col2:
-            chauffeur_filter = st.selectbox("Chauffeur", ["Tous"] + [c['full_name'] for c in get_chauffeurs()], key="sec_chauff")
-        with col3:
-            statut_filter = st.selectbox("Statut", ["Tous", "Nouvelle", "Confirmée", "PEC", "Déposée"], key="sec_statut")
-        with col4:
-            if show_all_sec:
-                total_courses = len(get_courses(days_back=3650))
-            else:
-                total_courses = len(get_courses())
-            st.metric("Total", total_courses)
-        
-        chauffeur_id = None
-        if chauffeur_filter != "Tous":
-            for c in get_chauffeurs():
-                if c['full_name'] == chauffeur_filter: 
-                    chauffeur_id = c['id']
-                    break
-        
-        date_filter_str = None
-        if not show_all_sec and date_filter:
-            date_filter_str = date_filter.strftime('%Y-%m-%d')
-        
-        if show_all_sec: 
-            st.info(f"📅 Affichage de TOUTES les courses (sans limite de date)")
-            courses = get_courses(show_all=True)  # Sans chauffeur_id
-        else:
-            date_filter_str = date_filter.strftime('%Y-%m-%d')
-            st.info(f"📅 Courses du {date_filter.strftime('%d/%m/%Y')}")
-            courses = get_courses(chauffeur_id=chauffeur_id, date_filter=date_filter_str)
-        
-        st.info(f"📊 {len(courses)} course(s)")
-        
-        if courses:
-            for course in courses:
-                statut_mapping = {'Nouvelle':  'nouvelle', 'Confirmée': 'confirmee', 'PEC': 'pec', 'Déposée':  'deposee'}
-                
-                if statut_filter != "Tous":
-                    statut_reel = statut_mapping.get(statut_filter, statut_filter. lower())
-                    if course['statut'].lower() != statut_reel.lower():
-                        continue
-                
-                statut_colors = {
-                    'nouvelle': '🔵',
-                    'confirmee': '🟡',
-                    'pec': '🔴',
-                    'deposee': '🟢'
-                }
-                
-                date_fr = format_date_fr(course['heure_prevue'])
-                heure_affichage = course. get('heure_pec_prevue', extract_time_str(course['heure_prevue']))
-                titre = f"{statut_colors.get(course['statut'], '⚪')} {date_fr} {heure_affichage} - {course['nom_client']} ({course['chauffeur_name']})"
-                
-                with st.expander(titre):
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"**Client :** {course['nom_client']}")
-                        st.write(f"**Tel :** {course['telephone_client']}")
-                        st.write(f"**PEC :** {course['adresse_pec']}")
-                        st.write(f"**Dépose :** {course['lieu_depose']}")
-                    with col2:
-                        st.write(f"**Chauffeur :** {course['chauffeur_name']}")
-                        st.write(f"**Tarif :** {course['tarif_estime']}€")
-                        st. write(f"**Km :** {course['km_estime']} km")
-                    
-                    if course.get('commentaire_chauffeur'):
-                        st. warning(f"💭 {course['commentaire_chauffeur']}")
-                    
-                    st.markdown("---")
-                    
-                    col_btn1, col_btn2 = st.columns(2)
-                    
-                    with col_btn1:
-                        if st.button(f"🗑️ Supprimer", key=f"del_sec_{course['id']}", use_container_width=True):
-                            st.session_state[f'confirmer_suppression_{course["id"]}'] = True
-                            st. rerun()
-                    
-                    with col_btn2:
-                        if st.button(f"✏️ Modifier", key=f"mod_sec_{course['id']}", use_container_width=True):
-                            st.session_state[f'modifier_course_{course["id"]}'] = True
-                            st.rerun()
-                    
-                    if st.session_state.get(f'confirmer_suppression_{course["id"]}', False):
-                        st.markdown("---")
-                        st.warning("⚠️ Confirmer la suppression ? ")
-                        
-                        col_conf1, col_conf2 = st.columns(2)
-                        with col_conf1:
-                            if st.button("❌ Annuler", key=f"cancel_del_{course['id']}", use_container_width=True):
-                                del st.session_state[f'confirmer_suppression_{course["id"]}']
-                                st.rerun()
-                        with col_conf2:
-                            if st.button("✅ Confirmer", key=f"confirm_del_{course['id']}", use_container_width=True):
-                                delete_course(course['id'])
-                                del st.session_state[f'confirmer_suppression_{course["id"]}']
-                                st.rerun()
-                    
-                    if st.session_state.get(f'modifier_course_{course["id"]}', False):
-                        st. markdown("---")
-                        st.subheader("✏️ Modifier")
-                        
-                        chauffeurs_list = get_chauffeurs()
-                        
-                        heure_actuelle = course.get('heure_pec_prevue', '')
-                        nouvelle_heure_pec = st.text_input(
-                            "Heure PEC (HH:MM)",
-                            value=heure_actuelle,
-                            key=f"input_heure_mod_{course['id']}"
-                        )
-                        
-                        chauffeur_actuel_index = 0
-                        for i, ch in enumerate(chauffeurs_list):
-                            if ch['id'] == course['chauffeur_id']: 
-                                chauffeur_actuel_index = i
-                                break
-                        
-                        nouveau_chauffeur = st.selectbox(
-                            "Chauffeur",
-                            options=chauffeurs_list,
-                            format_func=lambda x:  x['full_name'],
-                            index=chauffeur_actuel_index,
-                            key=f"select_chauffeur_mod_{course['id']}"
-                        )
-                        
-                        col_save, col_cancel = st.columns(2)
-                        with col_save: 
-                            if st.button("💾 Enregistrer", key=f"save_mod_{course['id']}", use_container_width=True):
-                                heure_valide = True
-                                nouvelle_heure_normalisee = None
-                                
-                                if nouvelle_heure_pec:
-                                    parts = nouvelle_heure_pec.split(':')
-                                    if len(parts) == 2:
-                                        try: 
-                                            h = int(parts[0])
-                                            m = int(parts[1])
-                                            if 0 <= h <= 23 and 0 <= m <= 59:
-                                                nouvelle_heure_normalisee = f"{h: 02d}:{m:02d}"
-                                            else: 
-                                                st.error("❌ Heure invalide")
-                                                heure_valide = False
-                                        except ValueError:
-                                            st. error("❌ Format invalide")
-                                            heure_valide = False
-                                    else:
-                                        st. error("❌ Format invalide")
-                                        heure_valide = False
-                                
-                                if heure_valide:
-                                    update_course_details(course['id'], nouvelle_heure_normalisee, nouveau_chauffeur['id'])
-                                    del st.session_state[f'modifier_course_{course["id"]}']
-                                    st.rerun()
-                        
-                        with col_cancel:
-                            if st.button("❌ Annuler", key=f"cancel_mod_{course['id']}", use_container_width=True):
-                                del st.session_state[f'modifier_course_{course["id"]}']
-                                st.rerun()
-        else:
-            st.info("Aucune course")
+        run_in_fragment(secretaire_planning_panel)
+    
     with tab3:
         st.subheader("📅 Planning Hebdomadaire")
         
@@ -1504,7 +1761,7 @@ def secretaire_page():
         
         # Initialiser la date de référence
         if 'week_start_date' not in st.session_state:
-            st.session_state.week_start_date = datetime.now(TIMEZONE).date()
+            st.session_state.week_start_date = today_paris()
             # Ajuster au lundi
             days_to_monday = st.session_state.week_start_date.weekday()
             st.session_state.week_start_date = st.session_state.week_start_date - timedelta(days=days_to_monday)
@@ -1519,7 +1776,7 @@ def secretaire_page():
             st.markdown(f"### Semaine du {st.session_state.week_start_date.strftime('%d/%m')} au {week_end_date.strftime('%d/%m/%Y')}")
             
             if st.button("📅 Aujourd'hui"):
-                today = datetime.now(TIMEZONE).date()
+                today = today_paris()
                 days_to_monday = today.weekday()
                 st.session_state.week_start_date = today - timedelta(days=days_to_monday)
                 st.rerun()
@@ -1575,23 +1832,14 @@ def secretaire_page():
                         
                         if courses_chauffeur:
                             for course in courses_chauffeur:
-                                statut_emoji = {
-                                    'nouvelle': '🔵',
-                                    'confirmee': '🟡',
-                                    'pec': '🔴',
-                                    'deposee': '🟢'
-                                }
-                                emoji = statut_emoji.get(course['statut'], '⚪')
+                                emoji = STATUT_EMOJIS.get(course['statut'], '⚪')
                                 
                                 heure_affichage = course.get('heure_pec_prevue')
                                 if not heure_affichage:
                                     heure_affichage = extract_time_str(course['heure_prevue'])
                                 
                                 if heure_affichage:
-                                    parts = heure_affichage.split(':')
-                                    if len(parts) == 2:
-                                        h, m = parts
-                                        heure_affichage = f"{int(h):02d}:{m}"
+                                    heure_affichage = normalize_hhmm(heure_affichage) or heure_affichage
                                 
                                 with st.popover(f"{emoji} {heure_affichage} - {course['nom_client']}", use_container_width=True):
                                     st.markdown(f"**{course['nom_client']}**")
@@ -1599,10 +1847,7 @@ def secretaire_page():
                                     
                                     if course.get('heure_pec_prevue'):
                                         heure_pec = course['heure_pec_prevue']
-                                        parts = heure_pec.split(':')
-                                        if len(parts) == 2:
-                                            h, m = parts
-                                            heure_pec = f"{int(h):02d}:{m}"
+                                        heure_pec = normalize_hhmm(heure_pec) or heure_pec
                                         st.caption(f"⏰ **Heure PEC:** {heure_pec}")
                                     
                                     st.caption(f"📍 **PEC:** {course['adresse_pec']}")
@@ -1644,12 +1889,10 @@ def secretaire_page():
                                     with col_btn_detail1:
                                         if st.button("🗑️ Supprimer", key=f"del_detail_{course['id']}", use_container_width=True):
                                             st.session_state[f'confirm_del_detail_{course["id"]}'] = True
-                                            st.rerun()
                                     
                                     with col_btn_detail2:
                                         if st.button("✏️ Modifier", key=f"mod_detail_{course['id']}", use_container_width=True):
                                             st.session_state[f'mod_detail_{course["id"]}'] = True
-                                            st.rerun()
                                     
                                     if st.session_state.get(f'confirm_del_detail_{course["id"]}', False):
                                         st.warning("⚠️ Confirmer la suppression ?")
@@ -1666,7 +1909,7 @@ def secretaire_page():
                                     
                                     if st.session_state.get(f'mod_detail_{course["id"]}', False):
                                         st.subheader("✏️ Modifier")
-                                        chauffeurs_list = get_chauffeurs()
+                                        chauffeurs_list = chauffeurs
                                         
                                         h_actuelle = course.get('heure_pec_prevue', '')
                                         new_h = st.text_input("Heure PEC", value=h_actuelle, key=f"h_detail_{course['id']}")
@@ -1684,20 +1927,9 @@ def secretaire_page():
                                                 h_ok = True
                                                 h_norm = None
                                                 if new_h:
-                                                    parts = new_h.split(':')
-                                                    if len(parts) == 2:
-                                                        try:
-                                                            h_int, m_int = int(parts[0]), int(parts[1])
-                                                            if 0 <= h_int <= 23 and 0 <= m_int <= 59:
-                                                                h_norm = f"{h_int:02d}:{m_int:02d}"
-                                                            else:
-                                                                st.error("❌ Heure invalide")
-                                                                h_ok = False
-                                                        except:
-                                                            st.error("❌ Format invalide")
-                                                            h_ok = False
-                                                    else:
-                                                        st.error("❌ Format invalide")
+                                                    h_norm = normalize_hhmm(new_h)
+                                                    if h_norm is None:
+                                                        st.error("❌ Format invalide (HH:MM)")
                                                         h_ok = False
                                                 
                                                 if h_ok:
@@ -1723,7 +1955,7 @@ def secretaire_page():
             # BOUTONS DE DISTRIBUTION
             st.markdown("### 📤 Distribution des courses")
             
-            date_aujourdhui = datetime.now(TIMEZONE).date()
+            date_aujourdhui = today_paris()
             jours_fr = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
             
             for day_offset in range(7):
@@ -1803,7 +2035,6 @@ def secretaire_page():
                                    type="secondary",
                                    use_container_width=True):
                             st.session_state['confirm_delete_week'] = True
-                            st.rerun()
                     else:
                         st.button("🗑️ Supprimer la semaine",
                                 use_container_width=True,
@@ -1842,16 +2073,8 @@ def secretaire_page():
                                 if purge_result['success']:
                                     st.success(f"🎉 {purge_result['count']} course(s) supprimée(s) !")
                                     
-                                    if 'week_archived' in st.session_state:
-                                        del st.session_state['week_archived']
-                                    if 'archive_filename' in st.session_state:
-                                        del st.session_state['archive_filename']
-                                    if 'archive_excel_data' in st.session_state:
-                                        del st.session_state['archive_excel_data']
-                                    if 'archive_count' in st.session_state:
-                                        del st.session_state['archive_count']
-                                    if 'confirm_delete_week' in st.session_state:
-                                        del st.session_state['confirm_delete_week']
+                                    for key in ARCHIVE_STATE_KEYS:
+                                        st.session_state.pop(key, None)
                                     
                                     st.rerun()
                                 else:
@@ -1895,12 +2118,7 @@ def secretaire_page():
                                 heure_a_afficher = extract_time_str(c['heure_prevue'])
                             
                             if heure_a_afficher:
-                                parts = heure_a_afficher.split(':')
-                                if len(parts) == 2:
-                                    h, m = parts
-                                    heure_normalisee = f"{int(h):02d}:{m}"
-                                else:
-                                    heure_normalisee = heure_a_afficher
+                                heure_normalisee = normalize_hhmm(heure_a_afficher) or heure_a_afficher
                             else:
                                 heure_normalisee = None
                             
@@ -1912,23 +2130,14 @@ def secretaire_page():
                         
                         if courses_slot:
                             for course in courses_slot:
-                                statut_emoji = {
-                                    'nouvelle': '🔵',
-                                    'confirmee': '🟡',
-                                    'pec': '🔴',
-                                    'deposee': '🟢'
-                                }
-                                emoji = statut_emoji.get(course['statut'], '⚪')
+                                emoji = STATUT_EMOJIS.get(course['statut'], '⚪')
                                 
                                 heure_affichage = course.get('heure_pec_prevue')
                                 if not heure_affichage:
                                     heure_affichage = extract_time_str(course['heure_prevue'])
                                 
                                 if heure_affichage:
-                                    parts = heure_affichage.split(':')
-                                    if len(parts) == 2:
-                                        h, m = parts
-                                        heure_affichage = f"{int(h):02d}:{m}"
+                                    heure_affichage = normalize_hhmm(heure_affichage) or heure_affichage
                                 
                                 chauffeur_prenom = course['chauffeur_name'].split()[0]
                                 with st.popover(f"{chauffeur_prenom}\n{emoji} {heure_affichage}", use_container_width=True):
@@ -1937,10 +2146,7 @@ def secretaire_page():
                                     
                                     if course.get('heure_pec_prevue'):
                                         heure_pec = course['heure_pec_prevue']
-                                        parts = heure_pec.split(':')
-                                        if len(parts) == 2:
-                                            h, m = parts
-                                            heure_pec = f"{int(h):02d}:{m}"
+                                        heure_pec = normalize_hhmm(heure_pec) or heure_pec
                                         st.caption(f"⏰ **Heure PEC:** {heure_pec}")
                                     else:
                                         st.caption(f"⏰ Création: {extract_time_str(course['heure_prevue'])}")
@@ -1982,7 +2188,7 @@ def secretaire_page():
         
         # Initialiser la date
         if 'planning_jour_date' not in st.session_state:
-            st.session_state.planning_jour_date = datetime.now(TIMEZONE).date()
+            st.session_state.planning_jour_date = today_paris()
         
         # Sélecteur de date
         selected_date = st.date_input(
@@ -2035,23 +2241,14 @@ def secretaire_page():
                             courses.sort(key=lambda c: c.get('heure_pec_prevue') or extract_time_str(c['heure_prevue']) or '')
                             
                             for course in courses:
-                                statut_emoji = {
-                                    'nouvelle': '🔵',
-                                    'confirmee': '🟡',
-                                    'pec': '🔴',
-                                    'deposee': '🟢'
-                                }
-                                emoji = statut_emoji.get(course['statut'], '⚪')
+                                emoji = STATUT_EMOJIS.get(course['statut'], '⚪')
                                 
                                 heure_affichage = course.get('heure_pec_prevue')
                                 if not heure_affichage:
                                     heure_affichage = extract_time_str(course['heure_prevue'])
                                 
                                 if heure_affichage:
-                                    parts = heure_affichage.split(':')
-                                    if len(parts) == 2:
-                                        h, m = parts
-                                        heure_affichage = f"{int(h):02d}:{m}"
+                                    heure_affichage = normalize_hhmm(heure_affichage) or heure_affichage
                                 
                                 label = f"{emoji} {heure_affichage} - {course['nom_client']} ({course['adresse_pec']} → {course['lieu_depose']})"
                                 
@@ -2073,11 +2270,7 @@ def secretaire_page():
                     col1, col2 = st.columns([1, 4])
                     with col1:
                         if st.button("🔄 Réattribuer", type="primary", use_container_width=True):
-                            success_count = 0
-                            for course_id in selected_course_ids:
-                                result = reassign_course_to_driver(course_id, nouveau_chauffeur_id)
-                                if result['success']:
-                                    success_count += 1
+                            success_count = reassign_courses_to_driver(selected_course_ids, nouveau_chauffeur_id)
                             
                             if success_count == len(selected_course_ids):
                                 st.success(f"✅ {success_count} course(s) réattribuée(s) à {nouveau_chauffeur_name} !")
@@ -2132,33 +2325,21 @@ def secretaire_page():
                     
                     if courses_chauffeur:
                         for course in courses_chauffeur:
-                            statut_emoji = {
-                                'nouvelle': '🔵',
-                                'confirmee': '🟡',
-                                'pec': '🔴',
-                                'deposee': '🟢'
-                            }
-                            emoji = statut_emoji.get(course['statut'], '⚪')
+                            emoji = STATUT_EMOJIS.get(course['statut'], '⚪')
                             
                             heure_affichage = course.get('heure_pec_prevue')
                             if not heure_affichage:
                                 heure_affichage = extract_time_str(course['heure_prevue'])
                             
                             if heure_affichage:
-                                parts = heure_affichage.split(':')
-                                if len(parts) == 2:
-                                    h, m = parts
-                                    heure_affichage = f"{int(h):02d}:{m}"
+                                heure_affichage = normalize_hhmm(heure_affichage) or heure_affichage
                             
                             with st.popover(f"{emoji} {heure_affichage} - {course['nom_client']}", use_container_width=True):
                                 st.markdown(f"**{course['nom_client']}** - {course['telephone_client']}")
                                 
                                 if course.get('heure_pec_prevue'):
                                     heure_pec = course['heure_pec_prevue']
-                                    parts = heure_pec.split(':')
-                                    if len(parts) == 2:
-                                        h, m = parts
-                                        heure_pec = f"{int(h):02d}:{m}"
+                                    heure_pec = normalize_hhmm(heure_pec) or heure_pec
                                     st.caption(f"⏰ {heure_pec} • {course['adresse_pec']} → {course['lieu_depose']}")
                                 else:
                                     st.caption(f"📍 {course['adresse_pec']} → {course['lieu_depose']}")
@@ -2176,7 +2357,6 @@ def secretaire_page():
                                     with col2:
                                         if st.button("Supp", key=f"del_jour_{course['id']}", use_container_width=True):
                                             st.session_state[f'confirm_del_jour_{course["id"]}'] = True
-                                            st.rerun()
                                 
                                 elif course['statut'] == 'confirmee':
                                     col1, col2 = st.columns(2)
@@ -2187,7 +2367,6 @@ def secretaire_page():
                                     with col2:
                                         if st.button("Supp", key=f"del_jour_{course['id']}", use_container_width=True):
                                             st.session_state[f'confirm_del_jour_{course["id"]}'] = True
-                                            st.rerun()
                                 
                                 elif course['statut'] == 'pec':
                                     col1, col2 = st.columns(2)
@@ -2198,12 +2377,10 @@ def secretaire_page():
                                     with col2:
                                         if st.button("Supp", key=f"del_jour_{course['id']}", use_container_width=True):
                                             st.session_state[f'confirm_del_jour_{course["id"]}'] = True
-                                            st.rerun()
                                 
                                 elif course['statut'] == 'deposee':
                                     if st.button("Supp", key=f"del_jour_{course['id']}", use_container_width=True):
                                         st.session_state[f'confirm_del_jour_{course["id"]}'] = True
-                                        st.rerun()
                                 
                                 if st.session_state.get(f'confirm_del_jour_{course["id"]}', False):
                                     st.warning("⚠️ Confirmer la suppression ?")
@@ -2248,7 +2425,7 @@ def secretaire_page():
             with col2:
                 lieu_depose_assistant = st.text_input("Lieu de dépose", key="lieu_depose_assistant",
                                                      help="Ex: Chartres Gare")
-                heure_prevue_assistant = st.time_input("Heure PEC", value=datetime.now(TIMEZONE).time(),
+                heure_prevue_assistant = st.time_input("Heure PEC", value=now_paris().time(),
                                                        key="heure_prevue_assistant")
             
             if st.button("🤖 Suggérer le meilleur chauffeur", type="primary", use_container_width=True):
@@ -2264,22 +2441,18 @@ def secretaire_page():
                             st.error("⚠️ Erreur : Clé API Google Maps non configurée")
                             st.stop()
                         
-                        date_aujourdhui = datetime.now(TIMEZONE).strftime('%Y-%m-%d')
+                        charges = get_driver_day_load(today_paris())
                         
                         chauffeurs_data = []
                         
                         for chauf in chauffeurs_list:
-                            courses_chauffeur = get_courses(chauffeur_id=chauf['id'], date_filter=date_aujourdhui)
-                            nb_courses = len(courses_chauffeur) if courses_chauffeur else 0
+                            charge = charges.get(chauf['id'], {})
+                            nb_courses = charge.get('courses_today', 0)
                             
                             last_course_data = None
-                            if courses_chauffeur and len(courses_chauffeur) > 0:
-                                courses_triees = sorted(courses_chauffeur, 
-                                                       key=lambda x: x.get('heure_prevue', ''), 
-                                                       reverse=True)
-                                derniere = courses_triees[0]
+                            if nb_courses > 0:
                                 last_course_data = {
-                                    'lieu_depose': derniere.get('lieu_depose', '')
+                                    'lieu_depose': charge.get('last_depose') or ''
                                 }
                             
                             chauffeurs_data.append({
@@ -2291,11 +2464,12 @@ def secretaire_page():
                         
                         course_data = {
                             'adresse_pec': adresse_pec_assistant,
-                            'heure_prevue': datetime.now(TIMEZONE),
+                            'heure_prevue': now_paris(),
                             'lieu_depose': lieu_depose_assistant
                         }
                         
                         try:
+                            from assistant import suggest_best_driver
                             suggestions = suggest_best_driver(
                                 chauffeurs=chauffeurs_data,
                                 course_data=course_data,
@@ -2375,11 +2549,12 @@ def secretaire_page():
                                    use_container_width=True,
                                    type="primary" if i == 1 else "secondary"):
                             
+                            maintenant = now_paris()
                             heure_prevue_dt = datetime.combine(
-                                datetime.now(TIMEZONE).date(),
-                                course_info.get('heure_prevue', datetime.now(TIMEZONE).time())
+                                maintenant.date(),
+                                course_info.get('heure_prevue', maintenant.time())
                             )
-                            heure_prevue_dt = TIMEZONE.localize(heure_prevue_dt)
+                            heure_prevue_dt = heure_prevue_dt.replace(tzinfo=TIMEZONE)
                             
                             course_to_create = {
                                 'chauffeur_id': sug['driver_id'],
@@ -2399,10 +2574,8 @@ def secretaire_page():
                                 create_course(course_to_create)
                                 st.success(f"✅ Course créée et assignée à {sug['driver_name']} !")
                                 
-                                if 'assistant_suggestions' in st.session_state:
-                                    del st.session_state['assistant_suggestions']
-                                if 'assistant_course_data' in st.session_state:
-                                    del st.session_state['assistant_course_data']
+                                for key in ASSISTANT_STATE_KEYS:
+                                    st.session_state.pop(key, None)
                                 
                                 st.rerun()
                             except Exception as e:
@@ -2411,10 +2584,8 @@ def secretaire_page():
                 st.markdown("---")
                 
                 if st.button("🔄 Nouvelle suggestion", use_container_width=True):
-                    if 'assistant_suggestions' in st.session_state:
-                        del st.session_state['assistant_suggestions']
-                    if 'assistant_course_data' in st.session_state:
-                        del st.session_state['assistant_course_data']
+                    for key in ASSISTANT_STATE_KEYS:
+                        st.session_state.pop(key, None)
                     st.rerun()
 
 
@@ -2422,19 +2593,96 @@ def secretaire_page():
 # INTERFACE CHAUFFEUR - OPTIMISÉE
 # ============================================
 
+_refresh_config = st.secrets.get("app", {}) or {}
+REFRESH_SECONDS = int(_refresh_config.get("refresh_seconds", 30))
+# Espacement sans changement à l'écran : désactivé par défaut (un chauffeur qui attend
+# sa prochaine course ne doit pas recevoir les alertes en retard)
+REFRESH_MAX_SECONDS = max(REFRESH_SECONDS, int(_refresh_config.get("refresh_max_seconds", REFRESH_SECONDS)))
+# Nombre de rafraîchissements sans changement avant de doubler l'intervalle
+REFRESH_IDLE_RUNS = 4
+
+def track_refresh_activity(signature):
+    """Espace le rafraîchissement auto tant que rien ne change à l'écran
+    (onglet oublié), et revient à l'intervalle de base dès qu'un changement arrive."""
+    current = st.session_state.get('refresh_seconds', REFRESH_SECONDS)
+    target = current
+    if st.session_state.get('refresh_signature') != signature:
+        st.session_state.refresh_signature = signature
+        st.session_state.refresh_idle_runs = 0
+        target = REFRESH_SECONDS
+    else:
+        st.session_state.refresh_idle_runs = st.session_state.get('refresh_idle_runs', 0) + 1
+        if st.session_state.refresh_idle_runs >= REFRESH_IDLE_RUNS and current < REFRESH_MAX_SECONDS:
+            st.session_state.refresh_idle_runs = 0
+            target = min(current * 2, REFRESH_MAX_SECONDS)
+    if target != current:
+        # L'intervalle d'un fragment est fixé au rendu de la page : relance complète
+        st.session_state.refresh_seconds = target
+        st.rerun()
+
+def run_in_fragment(render):
+    """Exécute `render` dans un st.fragment : ses widgets ne relancent que lui.
+
+    Repli sur un appel direct (relance de toute la page) pour Streamlit < 1.37.
+    """
+    fragment = getattr(st, 'fragment', None)
+    if fragment is None:
+        render()
+    else:
+        fragment(render)()
+
+def rerun_fragment():
+    """Relance seulement le fragment en cours (toute la page pour Streamlit < 1.37).
+
+    Pour les bascules d'affichage : après une écriture en base, garder st.rerun().
+    """
+    if getattr(st, 'fragment', None) is None:
+        st.rerun()
+    else:
+        st.rerun(scope="fragment")
+
+def run_auto_refreshed(render, seconds, key):
+    """Relance seulement `render` toutes les `seconds` secondes (st.fragment).
+
+    Repli sur st_autorefresh, qui relance toute la page, pour Streamlit < 1.37.
+    """
+    fragment = getattr(st, 'fragment', None)
+    if fragment is None:
+        from streamlit_autorefresh import st_autorefresh
+        st_autorefresh(interval=seconds * 1000, key=key)
+        render()
+    else:
+        fragment(run_every=seconds)(render)()
+
 def chauffeur_page():
     if 'user' not in st.session_state:
         st.rerun()
         return
     
-    count = st_autorefresh(interval=30000, key="chauffeur_autorefresh")
-    
     st.title("🚖 Mes courses")
     st.markdown(f"**Connecté en tant que :** {st.session_state. user['full_name']} (Chauffeur)")
     
+    run_auto_refreshed(
+        chauffeur_live_panel,
+        st.session_state.get('refresh_seconds', REFRESH_SECONDS),
+        "chauffeur_autorefresh"
+    )
+
+def chauffeur_live_panel():
     NOTIFICATION_SOUND_BASE64 = """UklGRiQEAABXQVZFZm10IBAAAAABAAEAQB8AAEAfAAABAAgAZGF0YQAEAAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//AAD//wAA//8AAP//"""
     
-    unread_count = get_unread_count(st.session_state.user['id'])
+    # Filtres lus avant l'affichage des widgets : une seule connexion pour toute la page
+    show_all_chauff = st.session_state.get('chauffeur_show_all', False)
+    date_filter_str = None
+    if not show_all_chauff:
+        date_filter = st.session_state.get('chauffeur_date') or today_paris()
+        date_filter_str = date_filter.strftime('%Y-%m-%d')
+    try:
+        notifications, unread_count, courses = chauffeur_page_data(st.session_state.user['id'], date_filter_str)
+    except Exception:
+        # Déjà journalisé et annulé par db_cursor
+        st.error("❌ Impossible de charger vos courses, nouvel essai au prochain rafraîchissement.")
+        return
     
     if unread_count > 0:
         if 'last_notif_count' not in st.session_state:
@@ -2469,8 +2717,6 @@ def chauffeur_page():
         """, unsafe_allow_html=True)
         
         with st.expander("📋 Voir les notifications", expanded=True):
-            notifications = get_unread_notifications(st.session_state.user['id'])
-            
             for notif in notifications:
                 icon = {
                     'nouvelle_course': '🆕',
@@ -2494,29 +2740,22 @@ def chauffeur_page():
     
     with col_deconnexion:
         if st.button("🚪 Déconnexion"):
-            if "user" in st.session_state:
-                del st. session_state.user
-            st.rerun()
+            logout()
     
     with col_refresh:
-        if st.button("🔄 Actualiser (auto:  30s)", use_container_width=True):
+        refresh_seconds = st.session_state.get('refresh_seconds', REFRESH_SECONDS)
+        if st.button(f"🔄 Actualiser (auto:  {refresh_seconds}s)", use_container_width=True):
             st.rerun()
     
     st.markdown("---")
     
     col1, col2, col3 = st.columns([2, 1, 1])
     with col1:
-        show_all_chauff = st.checkbox("Toutes mes courses", value=False)
+        st.checkbox("Toutes mes courses", value=False, key="chauffeur_show_all")
         if not show_all_chauff: 
-            date_filter = st.date_input("Date", value=datetime.now())
-        else:
-            date_filter = None
+            st.date_input("Date", value=today_paris(), key="chauffeur_date")
     
-    date_filter_str = None
-    if not show_all_chauff and date_filter:
-        date_filter_str = date_filter.strftime('%Y-%m-%d')
-    
-    courses = get_courses(chauffeur_id=st.session_state.user['id'], date_filter=date_filter_str, role='chauffeur')
+    track_refresh_activity((unread_count, tuple((c['id'], c['statut']) for c in courses)))
     
     with col2:
         st.metric("Mes courses", len([c for c in courses if c['statut'] != 'deposee']))
@@ -2527,23 +2766,9 @@ def chauffeur_page():
         st.info("Aucune course")
     else:
         for course in courses:
-            statut_colors = {
-                'nouvelle': '🔵',
-                'confirmee': '🟡',
-                'pec': '🔴',
-                'deposee':  '🟢'
-            }
-            
-            statut_text = {
-                'nouvelle': 'NOUVELLE',
-                'confirmee':  'CONFIRMÉE',
-                'pec': 'PRISE EN CHARGE',
-                'deposee': 'TERMINÉE'
-            }
-            
             date_fr = format_date_fr(course['heure_prevue'])
-            heure_affichage = course. get('heure_pec_prevue', extract_time_str(course['heure_prevue']))
-            titre = f"{statut_colors. get(course['statut'], '⚪')} {date_fr} {heure_affichage} - {course['nom_client']} - {statut_text. get(course['statut'], course['statut']. upper())}"
+            heure_affichage = course.get('heure_pec_prevue') or extract_time_str(course['heure_prevue'])
+            titre = f"{STATUT_EMOJIS.get(course['statut'], '⚪')} {date_fr} {heure_affichage} - {course['nom_client']} - {STATUT_LIBELLES.get(course['statut'], course['statut']. upper())}"
             
             with st.expander(titre):
                 col1, col2 = st. columns(2)
@@ -2634,18 +2859,27 @@ def chauffeur_page():
                         st. caption(f"**Tarif réel :** {course.get('tarif_reel', course['tarif_estime'])}€")
 
 
+ROLE_PAGES = {
+    'admin': admin_page,
+    'secretaire': secretaire_page,
+    'chauffeur': chauffeur_page,
+}
+
+
 def main():
-    init_db()
-    
+    if not init_db():
+        # Base injoignable : ne pas garder l'échec en cache, réessayer au prochain rerun
+        init_db.clear()
+
     if 'user' not in st. session_state:
         login_page()
-    else:
-        if st.session_state.user['role'] == 'admin':
-            admin_page()
-        elif st.session_state.user['role'] == 'secretaire':
-            secretaire_page()
-        elif st.session_state.user['role'] == 'chauffeur':
-            chauffeur_page()
+        return
+
+    page = ROLE_PAGES.get(st.session_state.user['role'])
+    if page is None:
+        st.error(f"Rôle inconnu : {st.session_state.user['role']}")
+        return
+    page()
 
 
 if __name__ == "__main__":
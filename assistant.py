@@ -10,10 +10,103 @@ Utilise Google Maps Distance Matrix API pour calculs de distance réels.
 
 import requests
 from datetime import datetime, timedelta
-import pytz
+from zoneinfo import ZoneInfo
 
 # Configuration
-TIMEZONE = pytz.timezone('Europe/Paris')
+TIMEZONE = ZoneInfo('Europe/Paris')
+
+
+# L'API Distance Matrix accepte au plus 25 origines par requête
+MAX_ORIGINS_PER_REQUEST = 25
+
+
+def _parse_element(element):
+    """Convertit un élément de la matrice en dict de résultat."""
+    if element.get('status') != 'OK':
+        return {
+            'success': False,
+            'error': f"Route Error: {element.get('status')}"
+        }
+    
+    distance_meters = element['distance']['value']
+    duration_seconds = element['duration']['value']
+    
+    return {
+        'distance_km': round(distance_meters / 1000, 2),
+        'distance_meters': distance_meters,
+        'duration_min': round(duration_seconds / 60),
+        'duration_seconds': duration_seconds,
+        'success': True,
+        'error': None
+    }
+
+
+def calculate_distances(origins, destination, api_key):
+    """
+    Calcule en un seul appel API la distance de plusieurs adresses vers une même destination.
+    
+    Args:
+        origins (list): Adresses de départ (ex: dernières déposes des chauffeurs)
+        destination (str): Adresse d'arrivée
+        api_key (str): Clé API Google Maps
+        
+    Returns:
+        list: Un dict par origine, dans le même ordre et au même format
+              que calculate_distance()
+    """
+    
+    # URL de l'API Google Maps Distance Matrix
+    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+    results = []
+    
+    for start in range(0, len(origins), MAX_ORIGINS_PER_REQUEST):
+        batch = origins[start:start + MAX_ORIGINS_PER_REQUEST]
+        
+        # Paramètres de la requête (origines séparées par "|")
+        params = {
+            'origins': '|'.join(batch),
+            'destinations': destination,
+            'key': api_key,
+            'language': 'fr',
+            'units': 'metric'
+        }
+        
+        try:
+            # Appel API
+            response = requests.get(url, params=params, timeout=10)
+            response.raise_for_status()  # Lève exception si erreur HTTP
+            
+            data = response.json()
+            
+            # Vérifier le statut de la réponse
+            if data.get('status') != 'OK':
+                error = {
+                    'success': False,
+                    'error': f"API Error: {data.get('status')} - {data.get('error_message', 'Unknown error')}"
+                }
+                results.extend(dict(error) for _ in batch)
+                continue
+            
+            # Une ligne par origine, une seule colonne (la destination)
+            results.extend(_parse_element(row['elements'][0]) for row in data['rows'])
+            
+        except requests.exceptions.Timeout:
+            results.extend({
+                'success': False,
+                'error': 'Timeout: API took too long to respond'
+            } for _ in batch)
+        except requests.exceptions.RequestException as e:
+            results.extend({
+                'success': False,
+                'error': f'Request Error: {str(e)}'
+            } for _ in batch)
+        except Exception as e:
+            results.extend({
+                'success': False,
+                'error': f'Unexpected Error: {str(e)}'
+            } for _ in batch)
+    
+    return results
 
 
 def calculate_distance(origin, destination, api_key):
@@ -35,75 +128,12 @@ def calculate_distance(origin, destination, api_key):
             'error': str or None       # Message d'erreur si échec
         }
     """
-    
-    # URL de l'API Google Maps Distance Matrix
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-    
-    # Paramètres de la requête
-    params = {
-        'origins': origin,
-        'destinations': destination,
-        'key': api_key,
-        'language': 'fr',
-        'units': 'metric'
-    }
-    
-    try:
-        # Appel API
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()  # Lève exception si erreur HTTP
-        
-        data = response.json()
-        
-        # Vérifier le statut de la réponse
-        if data.get('status') != 'OK':
-            return {
-                'success': False,
-                'error': f"API Error: {data.get('status')} - {data.get('error_message', 'Unknown error')}"
-            }
-        
-        # Extraire les données du premier résultat
-        element = data['rows'][0]['elements'][0]
-        
-        if element.get('status') != 'OK':
-            return {
-                'success': False,
-                'error': f"Route Error: {element.get('status')}"
-            }
-        
-        # Extraire distance et durée
-        distance_meters = element['distance']['value']
-        duration_seconds = element['duration']['value']
-        
-        return {
-            'distance_km': round(distance_meters / 1000, 2),
-            'distance_meters': distance_meters,
-            'duration_min': round(duration_seconds / 60),
-            'duration_seconds': duration_seconds,
-            'success': True,
-            'error': None
-        }
-        
-    except requests.exceptions.Timeout:
-        return {
-            'success': False,
-            'error': 'Timeout: API took too long to respond'
-        }
-    except requests.exceptions.RequestException as e:
-        return {
-            'success': False,
-            'error': f'Request Error: {str(e)}'
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'error': f'Unexpected Error: {str(e)}'
-        }
+    return calculate_distances([origin], destination, api_key)[0]
 
 
 # ============ FONCTIONS À AJOUTER DANS LES PROCHAINES ÉTAPES ============
 
-def calculate_driver_score(driver_data, course_data, api_key):
+def calculate_driver_score(driver_data, course_data, api_key, dist_result=None):
     """
     Calcule le score d'un chauffeur pour une course donnée.
     
@@ -120,6 +150,8 @@ def calculate_driver_score(driver_data, course_data, api_key):
             'lieu_depose': str
         }
         api_key (str): Clé API Google Maps
+        dist_result (dict, optional): Distance déjà calculée depuis la dernière
+            dépose (voir suggest_best_driver), sinon appel API individuel
         
     Returns:
         dict: {
@@ -147,11 +179,12 @@ def calculate_driver_score(driver_data, course_data, api_key):
         
         if last_depose:
             # Calculer distance entre dernière dépose et nouvelle PEC
-            dist_result = calculate_distance(
-                origin=last_depose,
-                destination=course_data['adresse_pec'],
-                api_key=api_key
-            )
+            if dist_result is None:
+                dist_result = calculate_distance(
+                    origin=last_depose,
+                    destination=course_data['adresse_pec'],
+                    api_key=api_key
+                )
             
             if dist_result['success']:
                 distance_km = dist_result['distance_km']
@@ -262,12 +295,22 @@ def suggest_best_driver(chauffeurs, course_data, api_key):
     
     scores = []
     
+    # Toutes les distances dernière dépose → PEC en un seul appel API
+    origins = []
+    for chauffeur in chauffeurs:
+        last_depose = (chauffeur.get('last_course') or {}).get('lieu_depose', '')
+        if last_depose and last_depose not in origins:
+            origins.append(last_depose)
+    distances = dict(zip(origins, calculate_distances(origins, course_data['adresse_pec'], api_key)))
+    
     # Calculer le score pour chaque chauffeur
     for chauffeur in chauffeurs:
+        last_depose = (chauffeur.get('last_course') or {}).get('lieu_depose', '')
         score_result = calculate_driver_score(
             driver_data=chauffeur,
             course_data=course_data,
-            api_key=api_key
+            api_key=api_key,
+            dist_result=distances.get(last_depose)
         )
         scores.append(score_result)
     
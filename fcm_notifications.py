@@ -9,8 +9,11 @@ from pyfcm import FCMNotification
 import os
 import streamlit as st
 import json
+import logging
 import tempfile
 
+logger = logging.getLogger(__name__)
+
 
 # ============================================
 # INITIALISATION FCM CLIENT - STREAMLIT CLOUD
@@ -33,7 +36,7 @@ def get_fcm_client():
             # STREAMLIT CLOUD : Lire depuis secrets
             # ============================================
             if 'firebase' in st.secrets and 'service_account' in st.secrets['firebase']:
-                print("📱 Lecture credentials Firebase depuis Streamlit Secrets...")
+                logger.info("Lecture credentials Firebase depuis Streamlit Secrets")
                 
                 # Parser le JSON depuis les secrets
                 firebase_config = json.loads(st.secrets['firebase']['service_account'])
@@ -44,7 +47,7 @@ def get_fcm_client():
                     json.dump(firebase_config, f)
                     temp_service_account_path = f.name
                 
-                print(f"✅ Fichier temporaire créé : {temp_service_account_path}")
+                logger.info("Fichier temporaire créé : %s", temp_service_account_path)
                 
                 # Initialiser le client FCM
                 _fcm_client = FCMNotification(
@@ -52,13 +55,13 @@ def get_fcm_client():
                     project_id=project_id
                 )
                 
-                print(f"✅ FCM Client initialisé avec projet: {project_id}")
+                logger.info("FCM Client initialisé avec projet : %s", project_id)
                 
             # ============================================
             # SERVEUR LOCAL : Lire depuis fichier (fallback)
             # ============================================
             else:
-                print("📁 Secrets Streamlit non trouvés, recherche fichier local...")
+                logger.info("Secrets Streamlit non trouvés, recherche fichier local")
                 
                 possible_paths = [
                     "./secrets/firebase-adminsdk.json",
@@ -73,8 +76,8 @@ def get_fcm_client():
                         break
                 
                 if not service_account_file:
-                    print("⚠️ Fichier Firebase service account non trouvé")
-                    print("💡 Pour Streamlit Cloud : Ajoutez le JSON dans Settings → Secrets")
+                    logger.warning("Fichier Firebase service account non trouvé "
+                                   "(Streamlit Cloud : ajouter le JSON dans Settings → Secrets)")
                     return None
                 
                 # Lire le project_id depuis le fichier
@@ -88,12 +91,10 @@ def get_fcm_client():
                     project_id=project_id
                 )
                 
-                print(f"✅ FCM Client initialisé avec projet: {project_id}")
+                logger.info("FCM Client initialisé avec projet : %s", project_id)
             
-        except Exception as e:
-            print(f"❌ Erreur initialisation FCM: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Erreur initialisation FCM")
             return None
     
     return _fcm_client
@@ -171,7 +172,7 @@ def send_nouvelle_course_notification(fcm_token, course_data):
             data_payload=data_payload
         )
         
-        print(f"✅ Notification FCM envoyée : {result}")
+        logger.debug("Notification FCM envoyée : %s", result)
         
         return {
             "success": True,
@@ -179,7 +180,7 @@ def send_nouvelle_course_notification(fcm_token, course_data):
         }
         
     except Exception as e:
-        print(f"❌ Erreur envoi notification FCM: {e}")
+        logger.exception("Erreur envoi notification FCM")
         return {
             "success": False,
             "error": str(e)
@@ -293,28 +294,24 @@ def update_chauffeur_fcm_token(chauffeur_id, new_fcm_token):
         # Import dynamique pour éviter circular import
         import sys
         if 'app' in sys.modules:
-            from app import get_db_connection, release_db_connection
+            from app import db_cursor
         else:
-            print("⚠️ Module app non chargé, impossible de mettre à jour le token")
-            return False
-        
-        conn = get_db_connection()
-        if not conn:
+            logger.warning("Module app non chargé, impossible de mettre à jour le token")
             return False
         
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users
-            SET fcm_token = %s
-            WHERE id = %s
-        ''', (new_fcm_token, chauffeur_id))
+        # Commit, rollback et retour au pool gérés par le context manager
+        with db_cursor() as cursor:
+            if cursor is None:
+                return False
+            cursor.execute('''
+                UPDATE users
+                SET fcm_token = %s
+                WHERE id = %s
+            ''', (new_fcm_token, chauffeur_id))
         
-        conn.commit()
-        release_db_connection(conn)
-        
-        print(f"✅ Token FCM mis à jour pour chauffeur {chauffeur_id}")
+        logger.info("Token FCM mis à jour pour chauffeur %s", chauffeur_id)
         return True
         
-    except Exception as e:
-        print(f"❌ Erreur mise à jour token FCM: {e}")
+    except Exception:
+        logger.exception("Erreur mise à jour token FCM chauffeur_id=%s", chauffeur_id)
         return False
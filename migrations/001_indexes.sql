@@ -0,0 +1,39 @@
+-- ============================================
+-- 001 - Index des requêtes de planning
+-- ============================================
+-- Idempotent : peut être rejoué sans risque.
+-- CREATE INDEX CONCURRENTLY ne bloque pas les écritures mais ne peut pas
+-- s'exécuter dans une transaction : lancer le fichier avec psql (autocommit)
+--   psql "$DATABASE_URL" -f migrations/001_indexes.sql
+--
+-- Vérifier l'utilisation avec EXPLAIN (ANALYZE, BUFFERS) sur les requêtes
+-- de get_courses / distribute_courses_for_date, puis pg_stat_user_indexes.
+
+-- Plages de dates sur heure_prevue : planning jour/semaine, archivage, purge.
+-- B-tree plutôt que BRIN : les courses sont saisies à l'avance, l'ordre
+-- physique des lignes ne suit pas heure_prevue.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_heure_prevue
+    ON courses (heure_prevue);
+
+-- Vue chauffeur : seules les courses distribuées sont lues.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_chauffeur_visible
+    ON courses (chauffeur_id, heure_prevue)
+    WHERE visible_chauffeur = true;
+
+-- Filtre chauffeur côté secrétariat/admin et charge du jour (assistant).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_chauffeur_date
+    ON courses (chauffeur_id, heure_prevue);
+
+-- Distribution du lendemain : très peu de lignes non distribuées.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_non_distribuees
+    ON courses (heure_prevue)
+    WHERE visible_chauffeur = false;
+
+-- Courses en cours (statistiques) : index partiel couvrant.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_actives
+    ON courses (heure_prevue) INCLUDE (chauffeur_id, id)
+    WHERE statut IN ('nouvelle', 'confirmee', 'pec');
+
+-- Pas d'index d'expression sur DATE(heure_prevue) : il ne sert que si la
+-- requête reprend l'expression à l'identique. Filtrer par plages sur
+-- heure_prevue (>= début, < fin) pour profiter de idx_courses_heure_prevue.
@@ -0,0 +1,22 @@
+-- ============================================
+-- 002 - Table notifications sans WAL
+-- ============================================
+-- Les notifications sont éphémères (lues puis oubliées) : UNLOGGED évite
+-- d'écrire chaque insertion dans le WAL. Contrepartie : la table est vidée
+-- après un arrêt brutal du serveur et n'est pas répliquée.
+-- Les nouvelles bases la créent déjà UNLOGGED (init_notifications_table).
+--
+-- SET UNLOGGED réécrit la table sous verrou exclusif : à lancer hors heures
+-- de service.
+--   psql "$DATABASE_URL" -f migrations/002_notifications_unlogged.sql
+
+ALTER TABLE notifications SET UNLOGGED;
+
+-- Purge des notifications de plus de 7 jours (aussi faite par l'application
+-- au démarrage, puis au plus une fois par heure quand un chauffeur lit ses
+-- notifications). Avec pg_cron (Supabase → Database → Extensions), la
+-- planifier chaque nuit :
+--   SELECT cron.schedule('purge-notifications', '0 3 * * *',
+--     $$DELETE FROM notifications WHERE created_at < NOW() - INTERVAL '7 days'$$);
+DELETE FROM notifications
+WHERE created_at < NOW() - INTERVAL '7 days';
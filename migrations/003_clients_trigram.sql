@@ -0,0 +1,15 @@
+-- ============================================
+-- 003 - Recherche de clients réguliers par trigrammes
+-- ============================================
+-- get_clients_reguliers filtre sur nom_complet ILIKE '%terme%' : sans index,
+-- chaque frappe dans le champ de recherche parcourt toute la table.
+-- Un index GIN pg_trgm sert ces recherches dès 3 caractères.
+-- Idempotent ; CONCURRENTLY impose de lancer le fichier hors transaction :
+--   psql "$DATABASE_URL" -f migrations/003_clients_trigram.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Même prédicat que la requête (seuls les clients actifs sont proposés)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clients_nom_trgm
+    ON clients_reguliers USING GIN (nom_complet gin_trgm_ops)
+    WHERE actif = 1;
@@ -0,0 +1,11 @@
+-- ============================================
+-- 004 - Filtre par statut du planning global
+-- ============================================
+-- get_courses(statut=...) ajoute c.statut = %s aux plages sur heure_prevue.
+-- Quatre valeurs seulement : un index sur statut seul serait peu sélectif,
+-- l'index composite sert le filtre et la plage de dates ensemble.
+-- Idempotent ; CONCURRENTLY impose de lancer le fichier hors transaction :
+--   psql "$DATABASE_URL" -f migrations/004_courses_statut.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_courses_statut_heure
+    ON courses (statut, heure_prevue);
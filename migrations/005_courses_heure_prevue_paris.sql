@@ -0,0 +1,36 @@
+-- ============================================
+-- 005 - Heures prévues saisies avant le passage aux instants
+-- ============================================
+-- Jusqu'ici create_course envoyait une chaîne sans fuseau : la session
+-- PostgreSQL (UTC sur Supabase) l'enregistrait comme une heure UTC alors que
+-- c'était l'heure de Paris. Les nouvelles courses sont enregistrées avec leur
+-- fuseau ; ce script recale les anciennes pour que l'affichage (converti en
+-- heure de Paris) et les bornes de journée à minuit heure de Paris les placent
+-- au bon jour et à la bonne heure.
+--
+-- À lancer UNE SEULE FOIS, avec l'id de la dernière course créée avant le
+-- déploiement de cette version (SELECT max(id) FROM courses juste avant) :
+--   psql "$DATABASE_URL" -v last_legacy_id=1234 -f migrations/005_courses_heure_prevue_paris.sql
+-- Prévu pour une colonne heure_prevue en timestamptz : le script s'arrête
+-- sans rien modifier dans le cas contraire.
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'courses' AND column_name = 'heure_prevue')
+       <> 'timestamp with time zone' THEN
+        RAISE EXCEPTION 'courses.heure_prevue n''est pas un timestamptz : migration non applicable';
+    END IF;
+END
+$$;
+
+-- 10:00 enregistré comme 10:00 UTC devient 10:00 heure de Paris
+UPDATE courses
+SET heure_prevue = (heure_prevue AT TIME ZONE 'UTC') AT TIME ZONE 'Europe/Paris'
+WHERE id <= :last_legacy_id;
+
+COMMIT;